@@ -0,0 +1,139 @@
+"""
+Пакетний запис у FalkorDB через параметризовані UNWIND-запити.
+
+Замість окремого GRAPH.QUERY на кожен вузол/зв'язок рядки групуються
+за міткою (або типом зв'язку), ріжуться на чанки і кожен чанк
+відправляється одним запитом `CYPHER rows=[...] UNWIND $rows AS row MERGE ...`.
+"""
+from query_builder import is_identifier, prepare, stringify_props, with_params
+
+DEFAULT_CHUNK_SIZE = 200
+
+
+def _chunks(items: list, size: int):
+    size = max(1, int(size or DEFAULT_CHUNK_SIZE))
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _returned_indexes(res) -> set:
+    """Збирає значення колонки idx з сирої відповіді GRAPH.QUERY."""
+    if not isinstance(res, list) or len(res) < 3 or not isinstance(res[1], list):
+        return set()
+    return {row[0] for row in res[1] if isinstance(row, list) and row}
+
+
+async def write_nodes(r, graph: str, label: str, nodes: list, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                      day_id: str = None, time: str = None) -> list:
+    """
+    MERGE вузлів однієї мітки чанками по chunk_size.
+    Повертає список результатів по кожному вхідному рядку (у вхідному порядку).
+    """
+    results = [None] * len(nodes)
+    rows = []
+    for idx, node_data in enumerate(nodes):
+        n_id = node_data.get('id') if isinstance(node_data, dict) else None
+        if not n_id:
+            results[idx] = {"index": idx, "status": "error", "message": "Missing node id"}
+            continue
+        rows.append({"idx": idx, "id": str(n_id), "props": stringify_props(node_data)})
+
+    if not is_identifier(label):
+        for row in rows:
+            results[row["idx"]] = {"index": row["idx"], "id": row["id"], "status": "error",
+                                   "message": f"Invalid node type: {label}"}
+        return results
+
+    node_query = prepare("unwind_merge_nodes", label=label)
+    link_day = bool(day_id and time and label != 'Entity')
+    day_query = prepare("unwind_happened_at", label=label)
+
+    for chunk in _chunks(rows, chunk_size):
+        try:
+            res = await r.execute_command("GRAPH.QUERY", graph, with_params(node_query, rows=chunk))
+            written = _returned_indexes(res)
+        except Exception as e:
+            for row in chunk:
+                results[row["idx"]] = {"index": row["idx"], "id": row["id"], "query": node_query,
+                                       "status": "error", "message": str(e)}
+            continue
+
+        for row in chunk:
+            if row["idx"] in written:
+                results[row["idx"]] = {"index": row["idx"], "id": row["id"], "query": node_query, "status": "success"}
+            else:
+                results[row["idx"]] = {"index": row["idx"], "id": row["id"], "query": node_query,
+                                       "status": "error", "message": "Node was not written"}
+
+        if not link_day or not written:
+            continue
+        day_rows = [{"idx": row["idx"], "id": row["id"]} for row in chunk if row["idx"] in written]
+        try:
+            res = await r.execute_command("GRAPH.QUERY", graph,
+                                          with_params(day_query, day_id=day_id, time=time, rows=day_rows))
+            linked = _returned_indexes(res)
+            for row in day_rows:
+                results[row["idx"]]["happened_at"] = "success" if row["idx"] in linked else "day not found"
+        except Exception as e:
+            for row in day_rows:
+                results[row["idx"]]["happened_at"] = f"error: {e}"
+
+    return results
+
+
+async def write_links(r, graph: str, links: list, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                      labels: dict = None) -> list:
+    """
+    MERGE зв'язків: один UNWIND-запит на кожен тип зв'язку (та пару міток кінців) і чанк.
+    labels — відомі мітки вузлів {id: label}; для них пошук кінця йде по індексу.
+    Рядок вважається успішним, якщо обидва кінці знайдено і зв'язок створено/знайдено.
+    """
+    labels = labels or {}
+    results = [None] * len(links)
+    by_type = {}
+    for idx, link in enumerate(links):
+        source_id = link.get('source_id') if isinstance(link, dict) else None
+        target_id = link.get('target_id') if isinstance(link, dict) else None
+        rel_type = link.get('type') if isinstance(link, dict) else None
+        if not source_id or not target_id or not rel_type:
+            results[idx] = {"index": idx, "status": "error", "message": "Missing source_id, target_id or type"}
+            continue
+        if not is_identifier(rel_type):
+            results[idx] = {"index": idx, "status": "error", "message": f"Invalid relation type: {rel_type}"}
+            continue
+        props = link.get('props') if isinstance(link.get('props'), dict) else {}
+        group = (rel_type, labels.get(str(source_id)), labels.get(str(target_id)))
+        by_type.setdefault(group, []).append({
+            "idx": idx,
+            "source_id": str(source_id),
+            "target_id": str(target_id),
+            "props": stringify_props(props, exclude=()),
+        })
+
+    for (rel_type, source_label, target_label), rows in by_type.items():
+        query = prepare("unwind_merge_links", rel_type=rel_type, source_label=source_label, target_label=target_label)
+        for chunk in _chunks(rows, chunk_size):
+            try:
+                res = await r.execute_command("GRAPH.QUERY", graph, with_params(query, rows=chunk))
+                linked = _returned_indexes(res)
+                error = None
+            except Exception as e:
+                linked = set()
+                error = str(e)
+
+            for row in chunk:
+                entry = {
+                    "index": row["idx"],
+                    "source_id": row["source_id"],
+                    "target_id": row["target_id"],
+                    "type": rel_type,
+                    "query": query,
+                }
+                if row["idx"] in linked:
+                    entry["status"] = "success"
+                else:
+                    entry["status"] = "error"
+                    entry["message"] = error or "Source or target node not found"
+                results[row["idx"]] = entry
+
+    return results
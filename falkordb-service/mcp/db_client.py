@@ -0,0 +1,174 @@
+"""
+Менеджер з'єднань з FalkorDB (redis.asyncio).
+
+Один обмежений BlockingConnectionPool на процес: таймаути сокетів,
+health-check з'єднань, повтори команд при обриві та перебудова пулу
+з експоненційною затримкою, якщо FalkorDB перезапустився.
+Використовується MCP-сервером (main.py) та llm-provider (background_listener).
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+
+import redis.asyncio as redis
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+logger = logging.getLogger("falkordb-client")
+
+
+class FalkorClientManager:
+    """Лінива ініціалізація клієнта, reconnect з backoff та статистика пулу."""
+
+    def __init__(self, host: str, port: int, max_connections: int = 32, pool_timeout: float = 10.0,
+                 socket_timeout: float = 30.0, socket_connect_timeout: float = 5.0,
+                 health_check_interval: int = 15, reconnect_attempts: int = 5,
+                 backoff_base: float = 0.5, backoff_cap: float = 10.0):
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.pool_timeout = pool_timeout
+        self.socket_timeout = socket_timeout
+        self.socket_connect_timeout = socket_connect_timeout
+        self.health_check_interval = health_check_interval
+        self.reconnect_attempts = reconnect_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+        self._client = None
+        self._pool = None
+        self._lock = asyncio.Lock()
+        self.healthy = False
+        self.reconnects = 0
+        self.last_error = None
+        self.connected_at = None
+
+    @classmethod
+    def from_env(cls, prefix: str = "FALKORDB", **overrides):
+        """Налаштування з оточення: FALKORDB_HOST, FALKORDB_PORT, FALKORDB_POOL_MAX тощо."""
+        def env(name, default):
+            return os.getenv(f"{prefix}_{name}", default)
+
+        settings = dict(
+            host=env("HOST", "falkordb"),
+            port=int(env("PORT", "6379")),
+            max_connections=int(env("POOL_MAX", "32")),
+            pool_timeout=float(env("POOL_TIMEOUT", "10")),
+            socket_timeout=float(env("SOCKET_TIMEOUT", "30")),
+            socket_connect_timeout=float(env("CONNECT_TIMEOUT", "5")),
+            health_check_interval=int(env("HEALTH_CHECK_INTERVAL", "15")),
+            reconnect_attempts=int(env("RECONNECT_ATTEMPTS", "5")),
+        )
+        settings.update(overrides)
+        return cls(**settings)
+
+    @property
+    def connected(self) -> bool:
+        return self._client is not None
+
+    def _build(self):
+        retry = Retry(ExponentialBackoff(cap=self.backoff_cap, base=self.backoff_base), retries=3)
+        pool = redis.BlockingConnectionPool(
+            host=self.host,
+            port=self.port,
+            max_connections=self.max_connections,
+            timeout=self.pool_timeout,
+            socket_timeout=self.socket_timeout,
+            socket_connect_timeout=self.socket_connect_timeout,
+            socket_keepalive=True,
+            health_check_interval=self.health_check_interval,
+            retry=retry,
+            retry_on_error=[RedisConnectionError],
+            decode_responses=False,
+        )
+        return redis.Redis(connection_pool=pool), pool
+
+    async def get(self) -> redis.Redis:
+        """Повертає клієнта, за потреби підключаючись з backoff."""
+        if self._client is not None:
+            return self._client
+        async with self._lock:
+            if self._client is None:
+                await self._connect_with_backoff()
+        return self._client
+
+    async def _connect_with_backoff(self):
+        delay = self.backoff_base
+        for attempt in range(1, self.reconnect_attempts + 1):
+            client, pool = self._build()
+            try:
+                await client.ping()
+            except Exception as e:
+                self.last_error = str(e)
+                self.healthy = False
+                await pool.disconnect()
+                if attempt == self.reconnect_attempts:
+                    raise
+                logger.warning(f"FalkorDB {self.host}:{self.port} unavailable (attempt {attempt}): {e}")
+                await asyncio.sleep(min(self.backoff_cap, delay) * (0.5 + random.random() / 2))
+                delay *= 2
+                continue
+            self._client, self._pool = client, pool
+            self.healthy = True
+            self.last_error = None
+            self.connected_at = time.time()
+            logger.info(f"FalkorDB connected at {self.host}:{self.port} (pool max={self.max_connections})")
+            return
+
+    async def reset(self):
+        """Скидає пул; наступний get() підключиться заново."""
+        async with self._lock:
+            pool = self._pool
+            self._client, self._pool = None, None
+            self.healthy = False
+            self.reconnects += 1
+        if pool is not None:
+            try:
+                await pool.disconnect()
+            except Exception as e:
+                logger.warning(f"Failed to close FalkorDB pool: {e}")
+
+    async def check_health(self) -> bool:
+        """PING через пул; при збої пул перебудовується."""
+        try:
+            client = await self.get()
+            await client.ping()
+            self.healthy = True
+            return True
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error(f"FalkorDB health check failed, rebuilding pool: {e}")
+            await self.reset()
+            return False
+
+    async def run_health_checks(self):
+        """Фонова перевірка з'єднання кожні health_check_interval секунд."""
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            await self.check_health()
+
+    def stats(self) -> dict:
+        pool = self._pool
+        in_use = len(getattr(pool, "_in_use_connections", ())) if pool is not None else 0
+        idle = len(getattr(pool, "_available_connections", ())) if pool is not None else 0
+        return {
+            "host": f"{self.host}:{self.port}",
+            "connected": pool is not None,
+            "healthy": self.healthy,
+            "max_connections": self.max_connections,
+            "in_use": in_use,
+            "idle": idle,
+            "utilization": round(in_use / self.max_connections, 3) if self.max_connections else 0,
+            "reconnects": self.reconnects,
+            "last_error": self.last_error,
+        }
+
+    async def close(self):
+        pool = self._pool
+        self._client, self._pool = None, None
+        self.healthy = False
+        if pool is not None:
+            await pool.disconnect()
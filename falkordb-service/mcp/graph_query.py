@@ -0,0 +1,53 @@
+"""
+Виконання довільного Cypher з інструменту query_graph.
+
+Спільний шлях для MCP-сервера (main.py) та прямого бекенду агента Klim у
+llm-provider: однакове декодування рядків (compact або verbose) та однаковий
+паралельний опит кількох графів, тож обидва бекенди повертають той самий JSON.
+"""
+import asyncio
+import time
+
+from result_formatter import format_falkordb_results, query_compact
+
+
+async def run_query(r, graph_name: str, query: str, schema_cache=None, timeout_ms: int = None,
+                    command: str = "GRAPH.QUERY") -> list:
+    """
+    Виконує запит та повертає рядки як список словників.
+    З schema_cache — compact-протокол, без нього — verbose-відповідь FalkorDB.
+    timeout_ms передається FalkorDB (TIMEOUT), щоб сервер теж припиняв роботу над запитом.
+    """
+    extra = ("TIMEOUT", timeout_ms) if timeout_ms else ()
+    if schema_cache is not None:
+        return await query_compact(r, graph_name, query, schema_cache, command=command, extra_args=extra)
+    res = await r.execute_command(command, graph_name, query, *extra)
+    return format_falkordb_results(res)
+
+
+async def fan_out(run_one_graph, graphs: list, concurrency: int = 4, timeout: float = 20.0) -> tuple:
+    """
+    Виконує run_one_graph(graph_name, timeout_ms) для кожного графа паралельно
+    (не більше concurrency одночасно), кожен зі своїм тайм-аутом.
+    Повертає (results, latency_ms) — словники за назвою графа; помилка графа стає {"error": ...}.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(graph_name):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(run_one_graph(graph_name, int(timeout * 1000)), timeout=timeout)
+            except asyncio.TimeoutError:
+                result = {"error": f"Timeout after {timeout}s"}
+            except Exception as e:
+                result = {"error": str(e)}
+            return graph_name, result, round((time.perf_counter() - started) * 1000, 1)
+
+    combined = {}
+    latency_ms = {}
+    for finished in asyncio.as_completed([run_one(g) for g in dict.fromkeys(graphs)]):
+        graph_name, result, elapsed = await finished
+        combined[graph_name] = result
+        latency_ms[graph_name] = elapsed
+    return combined, latency_ms
@@ -0,0 +1,105 @@
+"""
+Розв'язання id вузла в його мітку.
+
+MATCH (n {id: ...}) без мітки — це повний скан вузлів графа. Знаючи мітку,
+запит перетворюється на (n:Label {id: ...}), а з range-індексом на id —
+на пошук по індексу. Мітки запам'ятовуються при записі через MCP-інструменти,
+а невідомі id розв'язуються одним UNION-запитом по індексованих мітках.
+"""
+import logging
+from collections import OrderedDict
+from typing import get_args
+
+from models import NodeType, ServiceNodeType
+from query_builder import is_identifier, with_params
+
+logger = logging.getLogger("mcp-falkordb")
+
+INDEXED_LABELS = list(get_args(NodeType)) + list(get_args(ServiceNodeType))
+
+
+class IdLabelCache:
+    """LRU-кеш id -> мітка для одного графа."""
+
+    def __init__(self, labels: list = None, max_size: int = 50000):
+        self.labels = [l for l in (labels or INDEXED_LABELS) if is_identifier(l)]
+        self.max_size = max_size
+        self._labels = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Один запит з K індексних пошуків замість скану всього графа
+        self._resolve_query = " UNION ALL ".join(
+            f"MATCH (n:{label}) WHERE n.id IN $ids RETURN n.id AS id, '{label}' AS label"
+            for label in self.labels
+        )
+
+    def get(self, node_id: str):
+        label = self._labels.get(node_id)
+        if label is not None:
+            self._labels.move_to_end(node_id)
+        return label
+
+    def remember(self, node_id: str, label: str):
+        if not node_id or not is_identifier(label):
+            return
+        self._labels[str(node_id)] = label
+        self._labels.move_to_end(str(node_id))
+        while len(self._labels) > self.max_size:
+            self._labels.popitem(last=False)
+
+    def forget(self, node_id: str):
+        self._labels.pop(node_id, None)
+
+    def clear(self):
+        self._labels.clear()
+
+    async def resolve(self, r, graph: str, ids) -> dict:
+        """
+        Повертає {id: label} для всіх id, мітку яких вдалося знайти.
+        Id без результату (немає в графі або мітка не індексована) просто відсутні в словнику —
+        для них виклик використовує пошук без мітки.
+        """
+        found = {}
+        unknown = []
+        for node_id in dict.fromkeys(str(i) for i in ids if i):
+            label = self.get(node_id)
+            if label is None:
+                unknown.append(node_id)
+            else:
+                found[node_id] = label
+        self.hits += len(found)
+        self.misses += len(unknown)
+        if not unknown or not self.labels:
+            return found
+
+        try:
+            res = await r.execute_command("GRAPH.RO_QUERY", graph, with_params(self._resolve_query, ids=unknown))
+        except Exception as e:
+            logger.warning(f"Id label resolution failed: {e}")
+            return found
+        rows = res[1] if isinstance(res, list) and len(res) >= 3 else []
+        for node_id, label in rows:
+            node_id = node_id.decode('utf-8') if isinstance(node_id, bytes) else node_id
+            label = label.decode('utf-8') if isinstance(label, bytes) else label
+            if node_id not in found:
+                found[node_id] = label
+                self.remember(node_id, label)
+        return found
+
+    def stats(self) -> dict:
+        return {"size": len(self._labels), "hits": self.hits, "misses": self.misses}
+
+
+async def ensure_id_indexes(r, graph: str, labels: list = None) -> list:
+    """Створює range-індекси на id для кожної мітки. Вже існуючі індекси пропускаються."""
+    created = []
+    for label in labels or INDEXED_LABELS:
+        if not is_identifier(label):
+            continue
+        try:
+            await r.execute_command("GRAPH.QUERY", graph, f"CREATE INDEX FOR (n:{label}) ON (n.id)")
+            created.append(label)
+        except Exception as e:
+            if "already indexed" not in str(e).lower():
+                logger.warning(f"Failed to create index on :{label}(id): {e}")
+    return created
@@ -1,14 +1,30 @@
 import os
+import re
 import logging
 import json
 import uuid
 import asyncio
+import functools
+import time
+from collections import OrderedDict
 from datetime import datetime
-import redis.asyncio as redis
 from fastapi import FastAPI, Request
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from starlette.responses import JSONResponse
 
+from db_client import FalkorClientManager
+from batch_writer import DEFAULT_CHUNK_SIZE, write_nodes, write_links
+from id_resolver import IdLabelCache, ensure_id_indexes
+from write_set import WriteSet, WriteSetError
+from query_builder import build, stringify_props, template_cache_info, with_params
+from pagination import CursorError, decode_cursor, encode_cursor, fit_rows, is_ordered, is_pageable, page_query, split_paging
+from result_formatter import GraphSchemaCache, decode_falkor, format_falkordb_results
+from query_analysis import is_read_only
+from query_cache import QueryCache, bump_generation
+from read_router import ReadRouter
+from task_stream import publish_task, wait_result
+import graph_query
+
 import sys
 # Налаштування логування - ПРИМУСОВО в stderr для безпеки stdio
 logging.basicConfig(
@@ -25,36 +41,67 @@ app = FastAPI(title="FalkorDB MCP Server (Async)", version="0.1.0")
 app.add_middleware(TrustedHostMiddleware, allowed_hosts=["*"])
 
 # Глобальні змінні бази даних
-db_client = None
+db_manager = FalkorClientManager.from_env()
+# Read-only запити йдуть через GRAPH.RO_QUERY на репліки (FALKORDB_READ_REPLICAS) або primary
+read_router = ReadRouter.from_env(db_manager)
 GRAPH_NAME = os.getenv("GRAPH_NAME", "Grynya")
+# Compact-протокол FalkorDB для query_graph (мітки/ключі декодуються з кешу схеми)
+COMPACT_RESULTS = os.getenv("FALKORDB_COMPACT_RESULTS", "1") == "1"
+schema_cache = GraphSchemaCache()
+# Кеш id -> мітка для пошуку вузлів по індексу замість повного скану
+id_labels = IdLabelCache(max_size=int(os.getenv("ID_LABEL_CACHE_SIZE", "50000")))
+# Посторінковий query_graph_page: розмір сторінки та жорсткий бюджет байтів на відповідь
+DEFAULT_PAGE_SIZE = int(os.getenv("QUERY_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("QUERY_PAGE_MAX_SIZE", "1000"))
+PAGE_MAX_BYTES = int(os.getenv("QUERY_PAGE_MAX_BYTES", str(256 * 1024)))
+# Паралельний query_graph по кількох графах
+FANOUT_CONCURRENCY = int(os.getenv("QUERY_FANOUT_CONCURRENCY", "4"))
+GRAPH_QUERY_TIMEOUT = float(os.getenv("QUERY_GRAPH_TIMEOUT", "20"))
+# Кеш read-only запитів query_graph (LRU + TTL), скидається інструментами запису
+query_cache = QueryCache(
+    max_entries=int(os.getenv("QUERY_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("QUERY_CACHE_TTL", "300")),
+    max_rows=int(os.getenv("QUERY_CACHE_MAX_ROWS", "5000"))
+)
+# Скільки init_session_with_context чекає на контекст від Klim (секунди)
+KLIM_CONTEXT_TIMEOUT = float(os.getenv("KLIM_CONTEXT_TIMEOUT", "45"))
+# Асинхронний режим (wait=False): дедлайн задачі Klim та межа long-poll у get_research_context
+KLIM_ASYNC_CONTEXT_TIMEOUT = float(os.getenv("KLIM_ASYNC_CONTEXT_TIMEOUT", "300"))
+KLIM_CONTEXT_POLL_MAX = float(os.getenv("KLIM_CONTEXT_POLL_MAX", "25"))
+KLIM_CONTEXT_POLL_INTERVAL = float(os.getenv("KLIM_CONTEXT_POLL_INTERVAL", "0.5"))
+# Системний промпт (State -> System BLOCK_1/2/3): id стану (порожньо = будь-який State) та TTL кешу
+SYSTEM_STATE_ID = os.getenv("SYSTEM_PROMPT_STATE_ID", "")
+SYSTEM_PROMPT_TTL = float(os.getenv("SYSTEM_PROMPT_TTL", "300"))
 
 async def get_db():
-    global db_client
-    if db_client is None:
-        db_host = os.getenv("FALKORDB_HOST", "localhost")
-        if os.getenv("FALKORDB_PORT", None) is None:
-            db_host = "falkordb"
-        db_port = int(os.getenv("FALKORDB_PORT", "6379"))
-        try:
-            db_client = redis.Redis(host=db_host, port=db_port, decode_responses=False)
-            await db_client.ping()
-            logger.info("FalkorDB (redis.asyncio) connected lazily!")
-        except Exception as e:
-            logger.error(f"FalkorDB lazy connection failed: {e}")
-            raise e
-    return db_client
+    return await db_manager.get()
 
 @app.on_event("startup")
 async def startup_event():
-    global db_client
-    db_host = os.getenv("FALKORDB_HOST", "falkordb")
-    db_port = int(os.getenv("FALKORDB_PORT", "6379"))
     try:
-        db_client = redis.Redis(host=db_host, port=db_port, decode_responses=False)
-        await db_client.ping()
+        r = await db_manager.get()
         logger.info(f"FalkorDB connected successfully at startup!")
     except Exception as e:
         logger.error(f"FalkorDB connection failed at startup: {e}")
+    else:
+        try:
+            created = await ensure_id_indexes(r, GRAPH_NAME)
+            if created:
+                logger.info(f"Created id indexes for labels: {created}")
+        except Exception as e:
+            logger.warning(f"Id index provisioning failed: {e}")
+        try:
+            warmed = await chronology.warm(r, GRAPH_NAME)
+            logger.info(f"Chronology cache warmed with {warmed} days")
+        except Exception as e:
+            logger.warning(f"Chronology cache warm-up failed: {e}")
+    app.state.health_task = asyncio.create_task(db_manager.run_health_checks())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.health_task.cancel()
+    await read_router.close()
+    await db_manager.close()
 
 from mcp.server.fastmcp import FastMCP
 
@@ -65,72 +112,44 @@ mcp = FastMCP("grynya-falkordb-mcp", host="0.0.0.0")
 async def health():
     return JSONResponse(content={
         "status": "ok", 
-        "falkordb_connected": db_client is not None
+        "falkordb_connected": db_manager.connected,
+        "pool": db_manager.stats(),
+        "read_routing": read_router.stats(),
+        "query_templates": template_cache_info(),
+        "id_labels": id_labels.stats(),
+        "system_prompt_cache": prompt_cache.stats(),
+        "query_cache": query_cache.stats()
     })
 
 # Mount the MCP SSE application
 app.mount("/", mcp.sse_app())
 
-def e_str(value):
-    """Екранування рядків для Cypher."""
-    if value is None:
-        return '""'
-    escaped = str(value).replace('\\', '\\\\').replace('"', '\\"')
-    return f'"{escaped}"'
+async def run_query(r, graph_name: str, query: str, timeout_ms: int = None) -> list:
+    """
+    Виконує запит та повертає рядки як список словників (compact або verbose режим).
+    Read-only запити йдуть як GRAPH.RO_QUERY через read_router, записи — GRAPH.QUERY на primary.
+    """
+    compact_schema = schema_cache if COMPACT_RESULTS else None
+    if is_read_only(query):
+        return await read_router.run(lambda reader: graph_query.run_query(
+            reader, graph_name, query, compact_schema, timeout_ms, command="GRAPH.RO_QUERY"
+        ))
+    return await graph_query.run_query(r, graph_name, query, compact_schema, timeout_ms)
 
-def decode_falkor(item):
-    if isinstance(item, bytes):
-        try:
-            return item.decode('utf-8')
-        except:
-            return str(item)
-    elif isinstance(item, list):
-        return [decode_falkor(i) for i in item]
-    elif isinstance(item, dict):
-        return {decode_falkor(k): decode_falkor(v) for k, v in item.items()}
-    else:
-        return item
 
-def format_falkordb_results(res):
-    res_decoded = decode_falkor(res)
-    if len(res_decoded) < 3:
-        return []
-    
-    headers = res_decoded[0]
-    data = res_decoded[1]
-    
-    formatted_data = []
-    if not isinstance(headers, list) or not isinstance(data, list):
-        return []
-
-    for row in data:
-        row_dict = {}
-        for idx, col_name in enumerate(headers):
-            val = row[idx]
-            
-            # check if it's a node or edge
-            is_graph_entity = False
-            if isinstance(val, list) and len(val) > 0 and isinstance(val[0], list) and len(val[0]) == 2 and val[0][0] == 'id':
-                is_graph_entity = True
-                
-            if is_graph_entity:
-                obj_dict = {}
-                for prop_pair in val:
-                    if isinstance(prop_pair, list) and len(prop_pair) == 2:
-                        k, v = prop_pair
-                        if k == 'properties' and isinstance(v, list):
-                            props_dict = {}
-                            for p in v:
-                                if isinstance(p, list) and len(p) == 2:
-                                    props_dict[p[0]] = p[1]
-                            obj_dict[k] = props_dict
-                        else:
-                            obj_dict[k] = v
-                row_dict[col_name] = obj_dict
-            else:
-                row_dict[col_name] = val
-        formatted_data.append(row_dict)
-    return formatted_data
+async def run_cached_query(r, graph_name: str, query: str, timeout_ms: int = None) -> list:
+    """run_query через кеш читань (запити із записом кеш оминають)."""
+    return await query_cache.get_or_run(r, graph_name, query, lambda: run_query(r, graph_name, query, timeout_ms))
+
+
+async def _graph_written(r, graph_name: str = None):
+    """Після запису: скидає кеш читань графа та збільшує його покоління для кешів інших процесів."""
+    graph_name = graph_name or GRAPH_NAME
+    query_cache.invalidate(graph_name)
+    try:
+        await bump_generation(r, graph_name)
+    except Exception as e:
+        logger.warning(f"Failed to bump generation of graph {graph_name}: {e}")
 
 
 @mcp.tool()
@@ -142,60 +161,348 @@ async def query_graph(query: str, graphs: list = None) -> str:
             Якщо вказано кілька — виконує запит у кожному та об'єднує результати.
     """
     target_graphs = graphs if graphs else [GRAPH_NAME]
+    writes = not is_read_only(query)
+    if _may_touch_prompt(query):
+        for graph_name in target_graphs:
+            prompt_cache.invalidate(graph_name)
     try:
         r = await get_db()
+    except Exception as e:
+        return json.dumps({"status": "error", "message": str(e)})
+    try:
         if len(target_graphs) == 1:
-            res = await r.execute_command("GRAPH.QUERY", target_graphs[0], query)
-            formatted = format_falkordb_results(res)
+            formatted = await run_cached_query(r, target_graphs[0], query)
             return json.dumps({"status": "success", "graph": target_graphs[0], "results": formatted})
         
-        combined = {}
-        for graph_name in target_graphs:
-            try:
-                res = await r.execute_command("GRAPH.QUERY", graph_name, query)
-                combined[graph_name] = format_falkordb_results(res)
-            except Exception as e:
-                combined[graph_name] = {"error": str(e)}
-        return json.dumps({"status": "success", "multi_graph": True, "results": combined})
+        # Графи опитуються паралельно (не більше FANOUT_CONCURRENCY одночасно),
+        # кожен зі своїм тайм-аутом; результати збираються в міру завершення.
+        combined, latency_ms = await graph_query.fan_out(
+            lambda graph_name, timeout_ms: run_cached_query(r, graph_name, query, timeout_ms=timeout_ms),
+            target_graphs, concurrency=FANOUT_CONCURRENCY, timeout=GRAPH_QUERY_TIMEOUT
+        )
+        return json.dumps({"status": "success", "multi_graph": True, "results": combined, "latency_ms": latency_ms})
     except Exception as e:
         return json.dumps({"status": "error", "message": str(e)})
+    finally:
+        if writes:
+            # Запит міг видалити чи перейменувати вузли — мітки за id та відомі
+            # Year/Day/MONTH більше не гарантовані
+            id_labels.clear()
+            chronology.clear()
+            for graph_name in dict.fromkeys(target_graphs):
+                await _graph_written(r, graph_name)
+
+
+class ChronologyCache:
+    """
+    Пам'ятає вузли Day та зв'язки Year-[:MONTH]->Day, які точно існують у GRAPH_NAME.
+    Для відомого дня повторні MERGE Year/Day/MONTH замінюються на MATCH (d:Day {id}).
+    """
+
+    def __init__(self, max_days: int = 4096):
+        self.max_days = max_days
+        self._days = OrderedDict()  # day_id -> year_id (або None, якщо MONTH не перевірено)
+
+    def is_known(self, y_id: str, day_id: str) -> bool:
+        return self._days.get(day_id) == y_id
+
+    def has_day(self, day_id: str) -> bool:
+        return day_id in self._days
+
+    def remember(self, y_id: str, day_id: str):
+        self._days[day_id] = y_id
+        self._days.move_to_end(day_id)
+        while len(self._days) > self.max_days:
+            self._days.popitem(last=False)
+
+    def remember_day(self, day_id: str):
+        if day_id not in self._days:
+            self.remember(None, day_id)
+
+    def forget(self, node_id: str):
+        """Інвалідація при видаленні вузла: самого дня або року (разом з усіма його днями)."""
+        self._days.pop(node_id, None)
+        for day_id in [d for d, y in self._days.items() if y == node_id]:
+            self._days[day_id] = None
+
+    def forget_month(self, y_id: str, day_id: str):
+        if self._days.get(day_id) == y_id:
+            self._days[day_id] = None
+
+    def clear(self):
+        self._days.clear()
+
+    async def warm(self, r, graph: str, limit: int = 366) -> int:
+        """Підвантажує останні дні з графа (тепла множина на старті сервера)."""
+        res = await r.execute_command(
+            "GRAPH.RO_QUERY", graph,
+            with_params("MATCH (y:Year)-[:MONTH]->(d:Day) RETURN y.id, d.id ORDER BY d.id DESC LIMIT $limit", limit=limit)
+        )
+        for y_id, day_id in reversed(decode_falkor(res[1]) if _has_rows(res) else []):
+            self.remember(y_id, day_id)
+        return len(self._days)
+
+
+chronology = ChronologyCache(max_days=int(os.getenv("CHRONOLOGY_CACHE_SIZE", "4096")))
+
+
+# Мітки, з яких збирається системний промпт
+PROMPT_LABELS = {"State", "System"}
+_PROMPT_LABEL_RE = re.compile(r"\b(State|System)\b")
+
+
+def _may_touch_prompt(query: str) -> bool:
+    """Довільний Cypher з query_graph: запис, у тексті якого згадано State/System."""
+    return not is_read_only(query) and bool(_PROMPT_LABEL_RE.search(query))
+
+
+class SystemPromptCache:
+    """
+    Кеш зібраного тексту системного промпту за ключем (graph, state_id).
+    Запис живе ttl секунд; інструменти запису скидають його, якщо зачіпають :System або :State.
+    """
+
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self._entries = {}  # (graph, state_id) -> (text, expires_at)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, graph: str, state_id: str):
+        entry = self._entries.get((graph, state_id))
+        if entry is not None and entry[1] > time.monotonic():
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        return None
+
+    def put(self, graph: str, state_id: str, text: str):
+        if self.ttl > 0:
+            self._entries[(graph, state_id)] = (text, time.monotonic() + self.ttl)
+
+    def invalidate(self, graph: str = None):
+        if graph is None:
+            self._entries.clear()
+        else:
+            for key in [k for k in self._entries if k[0] == graph]:
+                del self._entries[key]
+
+    def invalidate_labels(self, graph: str, labels):
+        """Скидає кеш графа, якщо серед міток записаних вузлів є State/System (None — мітка невідома)."""
+        if any(label is None or label in PROMPT_LABELS for label in labels):
+            self.invalidate(graph)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "ttl": self.ttl}
+
+
+prompt_cache = SystemPromptCache(ttl=SYSTEM_PROMPT_TTL)
+
+
+def _has_rows(res) -> bool:
+    return isinstance(res, list) and len(res) >= 3 and bool(res[1])
+
+
+def _counts(res) -> list:
+    """Лічильники з першого рядка відповіді (RETURN count(...) AS matched[, ... AS affected])."""
+    if not _has_rows(res):
+        return [0]
+    return [int(v.decode('utf-8') if isinstance(v, bytes) else v) for v in res[1][0]]
+
+
+async def _relabel(r, stale: dict) -> dict:
+    """
+    stale — {id: мітка з кешу}, з якою MATCH нічого не знайшов. Мітки забуваються і
+    розв'язуються заново (індексний запит, без скану). Повертає нові мітки, якщо кожен
+    id знайдено і хоча б одна мітка змінилася; {} — вузлів справді немає, повтор не потрібен.
+    """
+    for node_id in stale:
+        id_labels.forget(node_id)
+    fresh = await id_labels.resolve(r, GRAPH_NAME, list(stale))
+    if set(fresh) != set(stale) or fresh == stale:
+        return {}
+    return fresh
+
+
+async def _execute_scoped(r, shape: str, scoped: dict, rel_type: str = None, **params) -> tuple:
+    """
+    Виконує запит форми shape з мітками вузлів з id_labels.
+    scoped — {"source_label"/"target_label": id вузла}. matched — кількість знайдених кінців,
+    affected — змінених зв'язків (якщо форма повертає їх окремо, інакше = matched).
+    Якщо кінців з мітками з кешу не знайдено, мітка могла застаріти (вузол перейменовано
+    через query_graph) — запит повторюється лише тоді, коли _relabel знайшов нові мітки.
+    Повертає (template, matched, affected, [задіяні мітки]).
+    """
+    labels = await id_labels.resolve(r, GRAPH_NAME, list(scoped.values()))
+    scope = {key: labels.get(str(node_id)) for key, node_id in scoped.items()}
+    involved = list(scope.values())
+    template, q = build(shape, rel_type=rel_type, **scope, **params)
+    counts = _counts(await r.execute_command("GRAPH.QUERY", GRAPH_NAME, q))
+    if counts[0] == 0:
+        stale = {str(scoped[key]): label for key, label in scope.items() if label}
+        fresh = await _relabel(r, stale) if stale else {}
+        if fresh:
+            scope = {key: fresh.get(str(node_id), scope[key]) for key, node_id in scoped.items()}
+            involved += list(scope.values())
+            template, q = build(shape, rel_type=rel_type, **scope, **params)
+            counts = _counts(await r.execute_command("GRAPH.QUERY", GRAPH_NAME, q))
+    return template, counts[0], counts[-1], involved
+
+
+def _invalid_date(date: str):
+    """Повідомлення про помилку, якщо date не у форматі YYYY-MM-DD; None — дата коректна."""
+    try:
+        datetime.strptime(date, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return f"Invalid date: {date!r} (expected YYYY-MM-DD)"
+    return None
+
+
+def _add_chronology(ws: WriteSet, date: str, year: int, known: bool = False) -> str:
+    """
+    Додає до набору вузли Year (y) / Day (d) та зв'язок MONTH для дати YYYY-MM-DD.
+    known=True — день вже є в графі (за кешем), тож достатньо MATCH (d:Day).
+    """
+    y_id = f"year_{year}"
+    day_id = f"d_{date.replace('-','_')}"
+    if known:
+        ws.match_node("d", "Day", day_id)
+        return day_id
+    ws.merge_node("y", "Year", y_id, key_props={"value": int(year), "name": str(year)})
+    ws.merge_node("d", "Day", day_id, key_props={"date": date, "name": date})
+    ws.merge_edge("y", "MONTH", "d", {"number": datetime.strptime(date, "%Y-%m-%d").month})
+    return day_id
+
+
+async def _commit_with_chronology(r, make_write_set, date: str, year: int) -> str:
+    """
+    Комітить набір, зібраний make_write_set(known), використовуючи кеш хронології.
+    Якщо закешований день зник з графа (MATCH нічого не знайшов) — кеш скидається
+    і набір повторюється з повними MERGE.
+    """
+    y_id = f"year_{year}"
+    day_id = f"d_{date.replace('-','_')}"
+    known = chronology.is_known(y_id, day_id)
+    try:
+        template = await make_write_set(known).commit(r, GRAPH_NAME)
+    except WriteSetError:
+        if not known:
+            raise
+        chronology.forget(day_id)
+        template = await make_write_set(False).commit(r, GRAPH_NAME)
+    chronology.remember(y_id, day_id)
+    id_labels.remember(y_id, "Year")
+    id_labels.remember(day_id, "Day")
+    await _graph_written(r)
+    return template
+
+
+@mcp.tool()
+async def query_graph_page(query: str, graph: str = None, cursor: str = None,
+                           page_size: int = DEFAULT_PAGE_SIZE, max_bytes: int = PAGE_MAX_BYTES) -> str:
+    """
+    Посторінково виконує Cypher запит (для великих вибірок на кшталт MATCH (n) RETURN n).
+    Повертає до page_size рядків, але не більше max_bytes JSON, та cursor наступної сторінки.
+    Щоб продовжити — виклич з тим самим query/graph та отриманим cursor; cursor=null означає кінець.
+    Для стабільного порядку сторінок запит має містити ORDER BY.
+    """
+    graph_name = graph or GRAPH_NAME
+    if not is_pageable(query):
+        return json.dumps({"status": "error", "message": "Only read-only queries with RETURN can be paginated"})
+
+    page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+    max_bytes = max(1024, min(int(max_bytes), PAGE_MAX_BYTES))
+    try:
+        offset = decode_cursor(cursor, query, graph_name) if cursor else 0
+    except CursorError as e:
+        return json.dumps({"status": "error", "message": str(e)})
+
+    def envelope(count: int, has_more: bool, next_offset: int, used: int) -> str:
+        return json.dumps({
+            "status": "success",
+            "graph": graph_name,
+            "offset": offset,
+            "count": count,
+            "has_more": has_more,
+            "cursor": encode_cursor(query, graph_name, next_offset) if has_more else None,
+            "ordered": is_ordered(base),
+            "bytes": used
+        })
+
+    base, skip, limit = split_paging(query)
+    count = page_size if limit is None else min(page_size, max(0, limit - offset))
+    # Бюджет max_bytes — на всю відповідь: резервуємо місце під конверт з найдовшими значеннями полів
+    results_suffix = ', "results": []}'
+    reserve = len(envelope(page_size, True, offset + page_size, max_bytes)) - 1 + len(results_suffix)
+    rows = []
+    if count > 0:
+        try:
+            r = await get_db()
+            # +1 рядок, щоб дізнатися, чи є ще дані, без окремого count-запиту
+            rows = await run_query(r, graph_name, page_query(base, skip + offset, count + 1))
+        except Exception as e:
+            return json.dumps({"status": "error", "message": str(e)})
+
+    more_in_db = len(rows) > count
+    rows = rows[:count]
+    serialized, consumed, used = fit_rows(rows, max_bytes - reserve)
+    next_offset = offset + consumed
+    has_more = consumed < len(rows) or (more_in_db and (limit is None or next_offset < limit))
+
+    # Рядки вже серіалізовані під час підрахунку бюджету — вклеюємо їх без повторного dumps
+    return envelope(consumed, has_more, next_offset, used)[:-1] + ', "results": [' + ",".join(serialized) + "]}"
 
 
 @mcp.tool()
 async def create_session(session_id: str, name: str, topic: str, trigger: str, date: str, year: int) -> str:
     """Відкриває нову сесію в графі та налаштовує хронологічні вузли (Year, Day)."""
+    date_error = _invalid_date(date)
+    if date_error:
+        return json.dumps({"status": "error", "message": date_error})
     try:
         r = await get_db()
     except Exception as e:
         return json.dumps({"status": "error", "message": str(e)})
         
-    queries = []
-    # 1. Session
-    props = f"name: {e_str(name)}, topic: {e_str(topic)}, status: 'active', trigger: {e_str(trigger)}"
-    queries.append(f"MERGE (s:Session {{id: '{session_id}'}}) SET s += {{{props}}}")
-    
-    # 2. Year & Day
-    month_num = date.split('-')[1]
-    y_id = f"year_{year}"
-    day_id = f"d_{date.replace('-','_')}"
-    queries.append(f"MERGE (y:Year {{value: {year}, id: '{y_id}', name: '{year}'}})")
-    queries.append(f"MERGE (d:Day {{date: '{date}', id: '{day_id}', name: '{date}'}})")
-    queries.append(f"MATCH (y:Year {{id: '{y_id}'}}), (d:Day {{id: '{day_id}'}}) MERGE (y)-[:MONTH {{number: {month_num}}}]->(d)")
+    # Session, Year, Day та MONTH пишуться одним атомарним запитом
+    props = stringify_props({"name": name, "topic": topic, "status": "active", "trigger": trigger})
+
+    def session_writes(known_day: bool) -> WriteSet:
+        ws = WriteSet()
+        ws.merge_node("s", "Session", session_id, props=props)
+        _add_chronology(ws, date, year, known_day)
+        return ws
     
-    results = []
-    for q in queries:
-        try:
-            await r.execute_command("GRAPH.QUERY", GRAPH_NAME, q)
-            results.append({"query": q, "status": "success"})
-        except Exception as e:
-            results.append({"query": q, "status": "error", "message": str(e)})
+    try:
+        template = await _commit_with_chronology(r, session_writes, date, year)
+    except WriteSetError as e:
+        return json.dumps({"status": "error", "message": str(e), "query": e.query})
+    id_labels.remember(session_id, "Session")
             
-    return json.dumps({"status": "success", "results": results})
+    return json.dumps({"status": "success", "results": [{"query": template, "status": "success"}]})
+
+
+async def _write_research_context(r, req_id: str, ctx_id: str, text: str, status: str):
+    """Записує (або оновлює) вузол Research_Context для запиту. Піднімає WriteSetError."""
+    ws = WriteSet()
+    ws.match_node("req", "Request", req_id)
+    ws.merge_node("c", "Research_Context", ctx_id, props=stringify_props({"text": text, "status": status}))
+    ws.merge_edge("c", "CONTEXT_FOR", "req")
+    await ws.commit(r, GRAPH_NAME)
+    id_labels.remember(ctx_id, "Research_Context")
+    await _graph_written(r)
 
 
 @mcp.tool()
-async def init_session_with_context(query: str, date: str, year: int, session_id: str = None) -> str:
-    """Ініціалізує нову сесію, відправляє запит на збір контексту Кліму через Redis Pub/Sub та чекає на результат."""
+async def init_session_with_context(query: str, date: str, year: int, session_id: str = None, wait: bool = True) -> str:
+    """
+    Ініціалізує нову сесію, ставить Кліму задачу на збір контексту в потік Redis Streams та чекає на результат.
+    wait=False — не чекати: повертає request_id/context_id одразу, вузол Research_Context
+    має статус "pending", доки Klim не запише контекст (див. get_research_context).
+    """
+    date_error = _invalid_date(date)
+    if date_error:
+        return json.dumps({"status": "error", "message": date_error})
     if not session_id:
         session_id = f"session_{uuid.uuid4().hex[:8]}"
         
@@ -206,87 +513,95 @@ async def init_session_with_context(query: str, date: str, year: int, session_id
         
     # Transaction 1
     req_id = f"req_{uuid.uuid4().hex[:8]}"
-    queries = []
-    
-    props = f"name: 'Async Session', topic: 'Auto-context', status: 'active', trigger: '/db'"
-    queries.append(f"MERGE (s:Session {{id: '{session_id}'}}) SET s += {{{props}}}")
-    
-    # Year & Day
-    month_num = date.split('-')[1]
-    y_id = f"year_{year}"
-    day_id = f"d_{date.replace('-','_')}"
-    queries.append(f"MERGE (y:Year {{value: {year}, id: '{y_id}', name: '{year}'}})")
-    queries.append(f"MERGE (d:Day {{date: '{date}', id: '{day_id}', name: '{date}'}})")
-    queries.append(f"MATCH (y:Year {{id: '{y_id}'}}), (d:Day {{id: '{day_id}'}}) MERGE (y)-[:MONTH {{number: {month_num}}}]->(d)")
-    
-    # Request
-    req_props = f"text: {e_str(query)}, role: 'user'"
-    queries.append(f"MERGE (req:Request {{id: '{req_id}'}}) SET req += {{{req_props}}}")
-    queries.append(f"MATCH (s:Session {{id: '{session_id}'}}), (req:Request {{id: '{req_id}'}}) MERGE (req)-[:PART_OF]->(s)")
-    
+    ctx_id = f"ctx_{uuid.uuid4().hex[:8]}"
+    deadline = time.time() + (KLIM_CONTEXT_TIMEOUT if wait else KLIM_ASYNC_CONTEXT_TIMEOUT)
+    props = {"name": "Async Session", "topic": "Auto-context", "status": "active", "trigger": "/db"}
+    req_props = stringify_props({"text": query, "role": "user"})
     time_str = datetime.now().strftime("%H:%M:%S")
-    queries.append(f"MATCH (req {{id: '{req_id}'}}), (d:Day {{id: '{day_id}'}}) MERGE (req)-[:HAPPENED_AT {{time: '{time_str}'}}]->(d)")
 
-    # Execute T1
-    for q in queries:
-        try:
-            await r.execute_command("GRAPH.QUERY", GRAPH_NAME, q)
-        except Exception as e:
-            return json.dumps({"status": "error", "message": f"T1 failed: {e}", "query": q})
+    def t1_writes(known_day: bool) -> WriteSet:
+        ws = WriteSet()
+        ws.merge_node("s", "Session", session_id, props=props)
+        
+        # Year & Day
+        _add_chronology(ws, date, year, known_day)
+        
+        # Request
+        ws.merge_node("req", "Request", req_id, props=req_props)
+        ws.merge_edge("req", "PART_OF", "s")
+        ws.merge_edge("req", "HAPPENED_AT", "d", {"time": time_str})
+        if not wait:
+            # Заглушка контексту: Klim заповнить її через complete_research_context
+            ctx_props = stringify_props({"text": "", "status": "pending", "deadline": deadline})
+            ws.merge_node("c", "Research_Context", ctx_id, props=ctx_props)
+            ws.merge_edge("c", "CONTEXT_FOR", "req")
+        return ws
+
+    # Execute T1 (один атомарний запит)
+    try:
+        await _commit_with_chronology(r, t1_writes, date, year)
+    except WriteSetError as e:
+        return json.dumps({"status": "error", "message": f"T1 failed: {e}", "query": e.query})
+    id_labels.remember(session_id, "Session")
+    id_labels.remember(req_id, "Request")
+    if not wait:
+        id_labels.remember(ctx_id, "Research_Context")
             
-    # Subscribe to Klim's response channel
-    pubsub = r.pubsub()
-    channel_name = f"klim:results:{session_id}"
-    await pubsub.subscribe(channel_name)
-    
-    # Publish task to Klim
+    # Задача йде в потік klim:tasks (consumer group воркерів Klim), результат —
+    # у список klim:results:<req_id> або, в асинхронному режимі, одразу у вузол
+    # context_id; deadline — коли результат перестає бути потрібним
+    # (прострочену задачу Klim відкине)
     task_payload = {
+        "task_id": req_id,
         "session_id": session_id,
         "task_type": "research_context",
         "query": query,
-        "timestamp": datetime.utcnow().isoformat() + "Z"
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "deadline": deadline
     }
-    await r.publish("klim:tasks", json.dumps(task_payload))
-    
-    # Await result with timeout
-    result_payload = None
+    if not wait:
+        task_payload["context_id"] = ctx_id
+        try:
+            await publish_task(r, task_payload)
+        except Exception as e:
+            try:
+                await _write_research_context(r, req_id, ctx_id, str(e), "error")
+            except WriteSetError as write_error:
+                logger.error(f"Failed to mark context {ctx_id} as failed: {write_error}")
+            return json.dumps({"status": "error", "message": str(e), "session_id": session_id,
+                               "request_id": req_id, "context_id": ctx_id})
+        return json.dumps({
+            "status": "success",
+            "session_id": session_id,
+            "request_id": req_id,
+            "context_id": ctx_id,
+            "klim_status": "pending"
+        })
+
     try:
-        async def wait_for_msg():
-            async for message in pubsub.listen():
-                if message["type"] == "message":
-                    return json.loads(message["data"])
-        
-        result_payload = await asyncio.wait_for(wait_for_msg(), timeout=45.0)
-    except asyncio.TimeoutError:
-        result_payload = {
-            "status": "error",
-            "context": "",
-            "error_msg": "Timeout waiting for Klim worker (45s)"
-        }
+        await publish_task(r, task_payload)
+        result_payload = await wait_result(r, req_id, KLIM_CONTEXT_TIMEOUT)
+        if result_payload is None:
+            result_payload = {
+                "status": "error",
+                "context": "",
+                "error_msg": f"Timeout waiting for Klim worker ({KLIM_CONTEXT_TIMEOUT:g}s)"
+            }
     except Exception as e:
          result_payload = {
             "status": "error",
             "context": "",
             "error_msg": str(e)
         }
-    finally:
-        await pubsub.unsubscribe(channel_name)
         
     # Transaction 2
-    ctx_id = f"ctx_{uuid.uuid4().hex[:8]}"
     ctx_status = result_payload.get("status", "error")
     ctx_text = result_payload.get("context", result_payload.get("error_msg", "Empty context"))
     
-    q_ctx = []
-    ctx_props = f"text: {e_str(ctx_text)}, status: '{ctx_status}'"
-    q_ctx.append(f"MERGE (c:Research_Context {{id: '{ctx_id}'}}) SET c += {{{ctx_props}}}")
-    q_ctx.append(f"MATCH (req:Request {{id: '{req_id}'}}), (c:Research_Context {{id: '{ctx_id}'}}) MERGE (c)-[:CONTEXT_FOR]->(req)")
-    
-    for q in q_ctx:
-        try:
-            await r.execute_command("GRAPH.QUERY", GRAPH_NAME, q)
-        except Exception as e:
-            logger.error(f"T2 failed: {e} query: {q}")
+    try:
+        await _write_research_context(r, req_id, ctx_id, ctx_text, ctx_status)
+    except WriteSetError as e:
+        logger.error(f"T2 failed: {e} query: {e.query}")
             
     return json.dumps({
         "status": "success",
@@ -297,6 +612,69 @@ async def init_session_with_context(query: str, date: str, year: int, session_id
         "context": ctx_text
     })
 
+
+@mcp.tool()
+async def complete_research_context(request_id: str, context_id: str, context: str, status: str = "success") -> str:
+    """Записує зібраний Klim контекст у вузол Research_Context (асинхронний режим init_session_with_context)."""
+    try:
+        r = await get_db()
+    except Exception as e:
+        return json.dumps({"status": "error", "message": str(e)})
+    try:
+        await _write_research_context(r, request_id, context_id, context, status)
+    except WriteSetError as e:
+        return json.dumps({"status": "error", "message": str(e), "query": e.query})
+    return json.dumps({"status": "success", "context_id": context_id})
+
+
+RESEARCH_CONTEXT_QUERY = (
+    "MATCH (c:Research_Context {id: $ctx_id}) "
+    "OPTIONAL MATCH (c)-[:CONTEXT_FOR]->(req:Request) "
+    "RETURN c.status AS status, c.text AS text, c.deadline AS deadline, req.id AS request_id"
+)
+
+
+@mcp.tool()
+async def get_research_context(context_id: str, wait_seconds: float = 0) -> str:
+    """
+    Повертає стан контексту від Klim: pending / success / error / expired.
+    wait_seconds > 0 — long-poll: чекає, поки контекст перестане бути pending
+    (не довше KLIM_CONTEXT_POLL_MAX секунд).
+    """
+    try:
+        r = await get_db()
+    except Exception as e:
+        return json.dumps({"status": "error", "message": str(e)})
+
+    # Читаємо з primary, щоб не бачити відставання реплік
+    query = with_params(RESEARCH_CONTEXT_QUERY, ctx_id=context_id)
+    compact_schema = schema_cache if COMPACT_RESULTS else None
+    wait_until = time.monotonic() + max(0.0, min(wait_seconds, KLIM_CONTEXT_POLL_MAX))
+    while True:
+        try:
+            rows = await graph_query.run_query(r, GRAPH_NAME, query, compact_schema, command="GRAPH.RO_QUERY")
+        except Exception as e:
+            return json.dumps({"status": "error", "message": str(e)})
+        if not rows:
+            return json.dumps({"status": "error", "message": f"Research_Context {context_id} not found"})
+        row = rows[0]
+        ctx_status = row.get("status") or "pending"
+        if ctx_status == "pending":
+            deadline = row.get("deadline")
+            if deadline and float(deadline) < time.time():
+                ctx_status = "expired"
+        if ctx_status != "pending" or time.monotonic() >= wait_until:
+            break
+        await asyncio.sleep(min(KLIM_CONTEXT_POLL_INTERVAL, max(0.0, wait_until - time.monotonic())))
+
+    return json.dumps({
+        "status": "success",
+        "context_id": context_id,
+        "request_id": row.get("request_id"),
+        "klim_status": ctx_status,
+        "context": row.get("text") or ""
+    })
+
 @mcp.tool()
 async def add_node(node_type: str, node_data: dict, day_id: str = None, time: str = None, relations: list = []) -> str:
     """
@@ -313,32 +691,76 @@ async def add_node(node_type: str, node_data: dict, day_id: str = None, time: st
         return json.dumps({"status": "error", "message": "Missing node id"})
         
     queries = []
-    props = ", ".join([f"{k}: {e_str(v)}" for k, v in node_data.items() if k != 'id'])
-    queries.append(f"MERGE (n:{node_type} {{id: '{n_id}'}}) SET n += {{{props}}}")
-    
-    if day_id and time and node_type != 'Entity':
-        queries.append(f"MATCH (n {{id: '{n_id}'}}), (d:Day {{id: '{day_id}'}}) MERGE (n)-[:HAPPENED_AT {{time: '{time}'}}]->(d)")
-        
-    for rel in relations:
-        r_type = rel.get('type')
-        target_id = rel.get('target_id')
-        r_props = rel.get('props')
-        if not r_type or not target_id: continue
+    day_query = None
+    # Запит зв'язку з міткою цілі з кешу -> (id цілі, мітка, побудова запиту з іншою міткою)
+    relabel_links = {}
+    try:
+        node_query = build("merge_node", label=node_type, id=str(n_id), props=stringify_props(node_data))
+        queries.append(node_query)
         
-        if r_props and isinstance(r_props, dict):
-            ps = ", ".join([f"{k}: {e_str(v)}" for k, v in r_props.items()])
-            queries.append(f"MATCH (s {{id: '{n_id}'}}), (t {{id: '{target_id}'}}) MERGE (s)-[r:{r_type}]->(t) SET r += {{{ps}}}")
-        else:
-            queries.append(f"MATCH (s {{id: '{n_id}'}}), (t {{id: '{target_id}'}}) MERGE (s)-[:{r_type}]->(t)")
+        if day_id and time and node_type != 'Entity':
+            day_query = build("link_happened_at", source_label=node_type, id=str(n_id), day_id=day_id, time=time)
+            queries.append(day_query)
+            
+        target_labels = await id_labels.resolve(r, GRAPH_NAME, [rel.get('target_id') for rel in relations])
+        for rel in relations:
+            r_type = rel.get('type')
+            target_id = rel.get('target_id')
+            r_props = rel.get('props')
+            if not r_type or not target_id: continue
             
+            ps = stringify_props(r_props, exclude=()) if isinstance(r_props, dict) else {}
+            target_label = target_labels.get(str(target_id))
+            link_query = build("merge_link", rel_type=r_type, source_label=node_type, target_label=target_label,
+                               source_id=str(n_id), target_id=str(target_id), props=ps)
+            queries.append(link_query)
+            if target_label:
+                relabel_links[id(link_query)] = (str(target_id), target_label, functools.partial(
+                    build, "merge_link", rel_type=r_type, source_label=node_type,
+                    source_id=str(n_id), target_id=str(target_id), props=ps))
+    except ValueError as e:
+        return json.dumps({"status": "error", "message": str(e)})
+
     results = []
-    for q in queries:
+    if day_query and chronology.has_day(day_id):
+        # День точно існує — вузол та HAPPENED_AT одним запитом
+        template, q = build("merge_node_at_day", label=node_type, id=str(n_id),
+                            props=stringify_props(node_data), day_id=day_id, time=time)
         try:
-            await r.execute_command("GRAPH.QUERY", GRAPH_NAME, q)
-            results.append({"query": q, "status": "success"})
+            res = await r.execute_command("GRAPH.QUERY", GRAPH_NAME, q)
+            if _has_rows(res):
+                results.append({"query": template, "status": "success"})
+                id_labels.remember(str(n_id), node_type)
+                queries = [item for item in queries if item is not node_query and item is not day_query]
+            else:
+                chronology.forget(day_id)
         except Exception as e:
-            results.append({"query": q, "status": "error", "message": str(e)})
-            
+            results.append({"query": template, "status": "error", "message": str(e)})
+            queries = [item for item in queries if item is not node_query and item is not day_query]
+
+    for item in queries:
+        template, q = item
+        try:
+            res = await r.execute_command("GRAPH.QUERY", GRAPH_NAME, q)
+            if id(item) in relabel_links and _counts(res)[0] == 0:
+                target_id, target_label, rebuild = relabel_links[id(item)]
+                fresh = await _relabel(r, {target_id: target_label})
+                if fresh:
+                    template, q = rebuild(target_label=fresh[target_id])
+                    target_labels[target_id] = fresh[target_id]
+                    res = await r.execute_command("GRAPH.QUERY", GRAPH_NAME, q)
+            results.append({"query": template, "status": "success"})
+            if item is node_query:
+                id_labels.remember(str(n_id), node_type)
+            elif item is day_query and _has_rows(res):
+                chronology.remember_day(day_id)
+        except Exception as e:
+            results.append({"query": template, "status": "error", "message": str(e)})
+
+    prompt_cache.invalidate_labels(GRAPH_NAME, [node_type] + [
+        target_labels.get(str(rel.get('target_id'))) for rel in relations if rel.get('target_id')
+    ])
+    await _graph_written(r)
     return json.dumps({"status": "success", "results": results})
 
 
@@ -350,14 +772,16 @@ async def link_nodes(source_id: str, target_id: str, rel_type: str, props: dict
     except Exception as e:
         return json.dumps({"status": "error", "message": str(e)})
     
-    if props:
-        ps = ", ".join([f"{k}: {e_str(v)}" for k, v in props.items()])
-        q = f"MATCH (s {{id: '{source_id}'}}), (t {{id: '{target_id}'}}) MERGE (s)-[r:{rel_type}]->(t) SET r += {{{ps}}}"
-    else:
-        q = f"MATCH (s {{id: '{source_id}'}}), (t {{id: '{target_id}'}}) MERGE (s)-[:{rel_type}]->(t)"
     try:
-        await r.execute_command("GRAPH.QUERY", GRAPH_NAME, q)
-        return json.dumps({"status": "success", "query": q})
+        ps = stringify_props(props, exclude=()) if props else {}
+        template, matched, _, labels = await _execute_scoped(
+            r, "merge_link", {"source_label": source_id, "target_label": target_id},
+            rel_type=rel_type, source_id=source_id, target_id=target_id, props=ps)
+        if not matched:
+            return json.dumps({"status": "error", "query": template, "message": "Source or target node not found"})
+        prompt_cache.invalidate_labels(GRAPH_NAME, labels)
+        await _graph_written(r)
+        return json.dumps({"status": "success", "query": template})
     except Exception as e:
         return json.dumps({"status": "error", "message": str(e)})
 
@@ -370,87 +794,93 @@ async def update_last_event(session_id: str, event_id: str) -> str:
     except Exception as e:
         return json.dumps({"status": "error", "message": str(e)})
     
-    queries = [
-        f"MATCH (s:Session {{id: '{session_id}'}})-[rel:LAST_EVENT]->() DELETE rel",
-        f"MATCH (s:Session {{id: '{session_id}'}}), (last {{id: '{event_id}'}}) MERGE (s)-[:LAST_EVENT]->(last)"
-    ]
     results = []
-    for q in queries:
-        try:
-            await r.execute_command("GRAPH.QUERY", GRAPH_NAME, q)
-            results.append({"query": q, "status": "success"})
-        except Exception as e:
-            results.append({"query": q, "status": "error", "message": str(e)})
+    template, q = build("clear_last_event", session_id=session_id)
+    try:
+        await r.execute_command("GRAPH.QUERY", GRAPH_NAME, q)
+        results.append({"query": template, "status": "success"})
+    except Exception as e:
+        results.append({"query": template, "status": "error", "message": str(e)})
+    try:
+        template, matched, _, _ = await _execute_scoped(
+            r, "set_last_event", {"target_label": event_id}, session_id=session_id, event_id=event_id)
+        if matched:
+            results.append({"query": template, "status": "success"})
+        else:
+            results.append({"query": template, "status": "error", "message": "Session or event node not found"})
+    except Exception as e:
+        results.append({"query": build("set_last_event", session_id=session_id, event_id=event_id)[0],
+                        "status": "error", "message": str(e)})
+    await _graph_written(r)
     return json.dumps({"status": "success", "results": results})
 
 
 @mcp.tool()
-async def batch_add_nodes(node_type: str, nodes: list, day_id: str = None, time: str = None) -> str:
+async def batch_add_nodes(node_type: str, nodes: list, day_id: str = None, time: str = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> str:
     """
     Додає декілька вузлів одного типу (наприклад, Entity) в граф за один раз.
+    Вузли пишуться UNWIND-запитами по chunk_size рядків (один round trip на чанк).
     """
     try:
         r = await get_db()
     except Exception as e:
         return json.dumps({"status": "error", "message": str(e)})
 
-    queries = []
-    for node_data in nodes:
-        n_id = node_data.get('id')
-        if not n_id:
-            continue
-        
-        props = ", ".join([f"{k}: {e_str(v)}" for k, v in node_data.items() if k != 'id'])
-        queries.append(f"MERGE (n:{node_type} {{id: '{n_id}'}}) SET n += {{{props}}}")
-        
-        if day_id and time and node_type != 'Entity':
-            queries.append(f"MATCH (n {{id: '{n_id}'}}), (d:Day {{id: '{day_id}'}}) MERGE (n)-[:HAPPENED_AT {{time: '{time}'}}]->(d)")
-
-    results = []
-    for q in queries:
-        try:
-            await r.execute_command("GRAPH.QUERY", GRAPH_NAME, q)
-            results.append({"query": q, "status": "success"})
-        except Exception as e:
-            results.append({"query": q, "status": "error", "message": str(e)})
-
+    results = await write_nodes(r, GRAPH_NAME, node_type, nodes, chunk_size=chunk_size, day_id=day_id, time=time)
+    for entry in results:
+        if entry.get("status") == "success":
+            id_labels.remember(entry["id"], node_type)
+    prompt_cache.invalidate_labels(GRAPH_NAME, [node_type])
+    await _graph_written(r)
     return json.dumps({"status": "success", "results": results})
 
 
 @mcp.tool()
-async def batch_link_nodes(links: list) -> str:
+async def batch_link_nodes(links: list, chunk_size: int = DEFAULT_CHUNK_SIZE) -> str:
     """
     Створює декілька зв'язків між вузлами за один раз.
+    Зв'язки групуються за типом і пишуться UNWIND-запитами по chunk_size рядків.
     """
     try:
         r = await get_db()
     except Exception as e:
         return json.dumps({"status": "error", "message": str(e)})
 
-    queries = []
+    endpoint_ids = []
     for link in links:
-        source_id = link.get('source_id')
-        target_id = link.get('target_id')
-        rel_type = link.get('type')
-        props = link.get('props')
-        
-        if not source_id or not target_id or not rel_type:
-            continue
-            
-        if props:
-            ps = ", ".join([f"{k}: {e_str(v)}" for k, v in props.items()])
-            queries.append(f"MATCH (s {{id: '{source_id}'}}), (t {{id: '{target_id}'}}) MERGE (s)-[r:{rel_type}]->(t) SET r += {{{ps}}}")
-        else:
-            queries.append(f"MATCH (s {{id: '{source_id}'}}), (t {{id: '{target_id}'}}) MERGE (s)-[:{rel_type}]->(t)")
+        if isinstance(link, dict):
+            endpoint_ids.extend([link.get('source_id'), link.get('target_id')])
+    labels = await id_labels.resolve(r, GRAPH_NAME, endpoint_ids)
+    results = await write_links(r, GRAPH_NAME, links, chunk_size=chunk_size, labels=labels)
+    involved = [labels.get(str(i)) for i in endpoint_ids if i]
 
-    results = []
-    for q in queries:
-        try:
-            await r.execute_command("GRAPH.QUERY", GRAPH_NAME, q)
-            results.append({"query": q, "status": "success"})
-        except Exception as e:
-            results.append({"query": q, "status": "error", "message": str(e)})
+    # Зв'язки, кінці яких не знайшлися за мітками з кешу: якщо мітки змінилися — повтор з новими
+    missed = [entry["index"] for entry in results if entry.get("message") == "Source or target node not found"]
+    stale = {}
+    for idx in missed:
+        for node_id in (str(links[idx]['source_id']), str(links[idx]['target_id'])):
+            if labels.get(node_id):
+                stale[node_id] = labels[node_id]
+    if stale:
+        for node_id in stale:
+            id_labels.forget(node_id)
+        fresh = await id_labels.resolve(r, GRAPH_NAME, list(stale))
 
+        def relabelled(link) -> bool:
+            ends = [str(link['source_id']), str(link['target_id'])]
+            ends = [node_id for node_id in ends if node_id in stale]
+            return bool(ends) and all(node_id in fresh for node_id in ends) and \
+                any(fresh[node_id] != stale[node_id] for node_id in ends)
+
+        retry = [idx for idx in missed if relabelled(links[idx])]
+        if retry:
+            labels.update(fresh)
+            retried = await write_links(r, GRAPH_NAME, [links[idx] for idx in retry], chunk_size=chunk_size, labels=labels)
+            for idx, entry in zip(retry, retried):
+                results[idx] = {**entry, "index": idx}
+            involved += list(fresh.values())
+    prompt_cache.invalidate_labels(GRAPH_NAME, involved)
+    await _graph_written(r)
     return json.dumps({"status": "success", "results": results})
 
 
@@ -459,9 +889,14 @@ async def delete_node(node_id: str) -> str:
     """Видаляє вузол з графа (включаючи всі його зв'язки)."""
     try:
         r = await get_db()
-        query = f"MATCH (n {{id: '{node_id}'}}) DETACH DELETE n"
-        await r.execute_command("GRAPH.QUERY", GRAPH_NAME, query)
-        return json.dumps({"status": "success", "query": query})
+        template, matched, _, labels = await _execute_scoped(r, "delete_node", {"source_label": node_id}, id=node_id)
+        chronology.forget(node_id)
+        id_labels.forget(node_id)
+        if not matched:
+            return json.dumps({"status": "error", "query": template, "message": "Node not found"})
+        prompt_cache.invalidate_labels(GRAPH_NAME, labels)
+        await _graph_written(r)
+        return json.dumps({"status": "success", "query": template})
     except Exception as e:
         return json.dumps({"status": "error", "message": str(e)})
 
@@ -471,9 +906,18 @@ async def delete_link(source_id: str, target_id: str, rel_type: str) -> str:
     """Видаляє конкретний зв'язок між вузлами."""
     try:
         r = await get_db()
-        query = f"MATCH (s {{id: '{source_id}'}})-[r:{rel_type}]->(t {{id: '{target_id}'}}) DELETE r"
-        await r.execute_command("GRAPH.QUERY", GRAPH_NAME, query)
-        return json.dumps({"status": "success", "query": query})
+        template, matched, deleted, labels = await _execute_scoped(
+            r, "delete_link", {"source_label": source_id, "target_label": target_id},
+            rel_type=rel_type, source_id=source_id, target_id=target_id)
+        if rel_type == "MONTH":
+            chronology.forget_month(source_id, target_id)
+        if not matched:
+            return json.dumps({"status": "error", "query": template, "message": "Source or target node not found"})
+        if not deleted:
+            return json.dumps({"status": "error", "query": template, "message": "Link not found"})
+        prompt_cache.invalidate_labels(GRAPH_NAME, labels)
+        await _graph_written(r)
+        return json.dumps({"status": "success", "query": template})
     except Exception as e:
         return json.dumps({"status": "error", "message": str(e)})
 
@@ -502,6 +946,9 @@ async def copy_graph(source_graph: str, destination_graph: str) -> str:
     try:
         r = await get_db()
         await r.execute_command("GRAPH.COPY", source_graph, destination_graph)
+        schema_cache.invalidate(destination_graph)
+        prompt_cache.invalidate(destination_graph)
+        await _graph_written(r, destination_graph)
         return json.dumps({
             "status": "success",
             "message": f"Graph '{source_graph}' copied to '{destination_graph}'",
@@ -514,29 +961,36 @@ async def copy_graph(source_graph: str, destination_graph: str) -> str:
 
 from mcp.types import PromptMessage, TextContent
 
+# Усі три блоки State -> System одним запитом; порядок: блок, потім sys.id
+SYSTEM_BLOCKS_QUERY = (
+    "MATCH (s:State)-[b:BLOCK_1|BLOCK_2|BLOCK_3]->(sys:System) "
+    "WHERE $state_id = '' OR s.id = $state_id "
+    "RETURN type(b) AS block, sys.name AS name, sys.content AS content ORDER BY block, sys.id"
+)
+
+
 async def _build_system_prompt_text() -> str:
-    """Генерує та повертає текст системного промпту зі State графа."""
+    """Генерує та повертає текст системного промпту зі State графа (з кешем на SYSTEM_PROMPT_TTL)."""
+    cached = prompt_cache.get(GRAPH_NAME, SYSTEM_STATE_ID)
+    if cached is not None:
+        return cached
     try:
         r = await get_db()
-        state_id = "state_test_1"
-        
-        q_role = f"MATCH (s:State)-[:BLOCK_1]->(sys:System) RETURN sys.name, sys.content ORDER BY sys.id"
-        r_role = format_falkordb_results(await r.execute_command("GRAPH.QUERY", GRAPH_NAME, q_role))
-        
-        q_rules = f"MATCH (s:State)-[:BLOCK_2]->(sys:System) RETURN sys.name, sys.content ORDER BY sys.id"
-        r_rules = format_falkordb_results(await r.execute_command("GRAPH.QUERY", GRAPH_NAME, q_rules))
-        
-        q_tasks = f"MATCH (s:State)-[:BLOCK_3]->(sys:System) RETURN sys.name, sys.content ORDER BY sys.id"
-        r_tasks = format_falkordb_results(await r.execute_command("GRAPH.QUERY", GRAPH_NAME, q_tasks))
+        rows = format_falkordb_results(await r.execute_command(
+            "GRAPH.RO_QUERY", GRAPH_NAME, with_params(SYSTEM_BLOCKS_QUERY, state_id=SYSTEM_STATE_ID)
+        ))
+        r_role = [row for row in rows if row.get('block') == 'BLOCK_1']
+        r_rules = [row for row in rows if row.get('block') == 'BLOCK_2']
+        r_tasks = [row for row in rows if row.get('block') == 'BLOCK_3']
         
         prompt_parts = []
         if r_role:
-             prompt_parts.append(f"## 1. Роль та Особистість\n\n{r_role[0].get('sys.content', '')}")
+             prompt_parts.append(f"## 1. Роль та Особистість\n\n{r_role[0].get('content', '')}")
              
         section_idx = 2
         if r_rules:
              for rule in r_rules:
-                 title = str(rule.get('sys.name', '')).replace('Системні правила (', '').replace(')', '')
+                 title = str(rule.get('name', '')).replace('Системні правила (', '').replace(')', '')
                  if title == 'Мовні Директиви':
                      title = 'Мовні Директиви (Суворий пріоритет)'
                  elif title == 'Код':
@@ -544,16 +998,17 @@ async def _build_system_prompt_text() -> str:
                  elif title == 'Межі Відповідальності':
                      title = 'Межі Відповідальності (Guardrails)'
                      
-                 prompt_parts.append(f"## {section_idx}. {title}\n\n{rule.get('sys.content', '')}")
+                 prompt_parts.append(f"## {section_idx}. {title}\n\n{rule.get('content', '')}")
                  section_idx += 1
                  
         if r_tasks:
              for task in r_tasks:
-                 title = str(task.get('sys.name', ''))
-                 prompt_parts.append(f"## {section_idx}. {title}\n\n{task.get('sys.content', '')}")
+                 title = str(task.get('name', ''))
+                 prompt_parts.append(f"## {section_idx}. {title}\n\n{task.get('content', '')}")
                  section_idx += 1
                  
         full_prompt = "\n\n---\n\n".join(prompt_parts)
+        prompt_cache.put(GRAPH_NAME, SYSTEM_STATE_ID, full_prompt)
         return full_prompt
     except Exception as e:
         logger.error(f"Failed to generate prompt text: {e}")
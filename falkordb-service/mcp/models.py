@@ -2,6 +2,8 @@ from typing import Optional, Literal, Dict, Any, List
 from pydantic import BaseModel, Field
 
 NodeType = Literal["Session", "Request", "Response", "Feedback", "Analysis", "Entity", "Year", "Day"]
+# Мітки поза схемою NodeType, які пишуть сервіси (Klim, init_session_with_context, системний промпт)
+ServiceNodeType = Literal["Research", "Research_Context", "State", "System"]
 RelationType = Literal["PART_OF", "RESPONDS_TO", "FEEDBACK_ON", "ANALYZES", "SUMMARIZES", "NEXT", "LAST_EVENT", "MONTH", "HAPPENED_AT", "INVOLVES", "MENTIONS"]
 
 class NodeProps(BaseModel):
@@ -0,0 +1,92 @@
+"""
+Посторінкове читання результатів Cypher-запиту.
+
+Запит дочитується лениво через SKIP/LIMIT, а позиція передається клієнту
+непрозорим курсором. Курсор прив'язаний до тексту запиту та графа, тож його
+не можна випадково застосувати до іншого запиту.
+"""
+import base64
+import hashlib
+import json
+import re
+
+from query_analysis import is_read_only
+
+_TRAILING_PAGING_RE = re.compile(r"(?:\s+SKIP\s+(\d+))?(?:\s+LIMIT\s+(\d+))?\s*;?\s*$", re.IGNORECASE)
+_RETURN_RE = re.compile(r"\bRETURN\b", re.IGNORECASE)
+_ORDER_BY_RE = re.compile(r"\bORDER\s+BY\b", re.IGNORECASE)
+
+
+class CursorError(ValueError):
+    """Курсор пошкоджений або виданий для іншого запиту/графа."""
+
+
+def _fingerprint(query: str, graph: str) -> str:
+    return hashlib.sha1(f"{graph}\n{query}".encode("utf-8")).hexdigest()[:16]
+
+
+def encode_cursor(query: str, graph: str, offset: int) -> str:
+    raw = json.dumps({"h": _fingerprint(query, graph), "o": offset}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, query: str, graph: str) -> int:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        offset = int(data["o"])
+    except Exception:
+        raise CursorError("Invalid cursor")
+    if data.get("h") != _fingerprint(query, graph) or offset < 0:
+        raise CursorError("Cursor does not match this query/graph")
+    return offset
+
+
+def split_paging(query: str) -> tuple:
+    """
+    Відокремлює хвостові SKIP/LIMIT користувача: (base_query, skip, limit).
+    Вони враховуються як загальні межі вибірки поверх сторінок.
+    """
+    query = query.strip()
+    match = _TRAILING_PAGING_RE.search(query)
+    skip = int(match.group(1)) if match and match.group(1) else 0
+    limit = int(match.group(2)) if match and match.group(2) else None
+    base = query[:match.start()] if match else query
+    return base.rstrip(), skip, limit
+
+
+def is_pageable(query: str) -> bool:
+    """
+    Лише read-only запити з RETURN: кожна сторінка заново виконує запит зі SKIP/LIMIT,
+    тож запис повторювався б на кожній сторінці.
+    """
+    return bool(_RETURN_RE.search(query)) and is_read_only(query)
+
+
+def is_ordered(query: str) -> bool:
+    return bool(_ORDER_BY_RE.search(query))
+
+
+def page_query(base: str, skip: int, count: int) -> str:
+    return f"{base} SKIP {skip} LIMIT {count}"
+
+
+def fit_rows(rows: list, max_bytes: int) -> tuple:
+    """
+    Відбирає рядки, поки їх JSON вкладається в max_bytes.
+    Повертає (serialized_rows, consumed, used_bytes); consumed — скільки вхідних рядків використано.
+    Рядок, який сам по собі більший за бюджет, замінюється маркером, щоб курсор рухався далі.
+    """
+    serialized = []
+    used = 0
+    for row in rows:
+        chunk = json.dumps(row, ensure_ascii=False)
+        size = len(chunk.encode("utf-8")) + 1
+        if used + size > max_bytes:
+            if serialized:
+                break
+            chunk = json.dumps({"_truncated_row": True, "bytes": size - 1})
+            size = len(chunk) + 1
+        serialized.append(chunk)
+        used += size
+    return serialized, len(serialized), used
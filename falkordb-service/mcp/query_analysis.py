@@ -0,0 +1,52 @@
+"""
+Легкий лексичний аналіз Cypher-запитів (без повного парсера).
+
+Рядкові літерали, `ідентифікатори в лапках` та коментарі вирізаються перед
+пошуком ключових слів, тож SET/DELETE всередині рядка не роблять запит записом.
+Аналіз консервативний: якщо є сумнів — запит вважається записом.
+"""
+import re
+
+_LITERAL_RE = re.compile(
+    r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`(?:[^`]|``)*`|//[^\n]*|/\*.*?\*/",
+    re.DOTALL,
+)
+_WRITE_RE = re.compile(r"\b(CREATE|MERGE|SET|DELETE|REMOVE|DROP|FOREACH|LOAD\s+CSV)\b", re.IGNORECASE)
+_CALL_RE = re.compile(r"\bCALL\s+([A-Za-z_][\w.]*)", re.IGNORECASE)
+
+# Процедури FalkorDB, які лише читають
+READ_PROCEDURES = (
+    "db.labels", "db.relationshiptypes", "db.propertykeys", "db.indexes", "db.constraints",
+    "db.meta.stats", "db.idx.fulltext.querynodes", "db.idx.fulltext.queryrelationships",
+    "db.idx.vector.querynodes", "db.idx.vector.queryrelationships", "algo.",
+)
+
+
+def strip_literals(query: str) -> str:
+    """Замінює літерали та коментарі на пробіл (для пошуку ключових слів)."""
+    return _LITERAL_RE.sub(" ", query)
+
+
+def is_read_only(query: str) -> bool:
+    """True, якщо запит не містить клауз запису та викликає лише процедури читання."""
+    bare = strip_literals(query)
+    if _WRITE_RE.search(bare):
+        return False
+    for procedure in _CALL_RE.findall(bare):
+        if not procedure.lower().startswith(READ_PROCEDURES):
+            return False
+    return True
+
+
+_TOKEN_RE = re.compile(
+    r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`(?:[^`]|``)*`|\s+|[^'\"`\s]+|.",
+    re.DOTALL,
+)
+
+
+def normalize_query(query: str) -> str:
+    """Ключ кешу: пробіли поза літералами стискаються до одного, хвостова `;` відкидається."""
+    parts = []
+    for token in _TOKEN_RE.findall(query.strip().rstrip(";").strip()):
+        parts.append(" " if token.isspace() else token)
+    return "".join(parts)
@@ -0,0 +1,122 @@
+"""
+Побудова параметризованих Cypher-запитів для FalkorDB.
+
+Кожен інструмент має стабільний шаблон запиту ("форму"), а значення
+передаються через префікс `CYPHER name=value ...`. FalkorDB кешує план
+виконання за текстом запиту без префікса, тому однакова форма = кеш-хіт
+замість повторного парсингу та планування на кожному записі.
+"""
+import os
+import re
+from functools import lru_cache
+
+TEMPLATE_CACHE_SIZE = int(os.getenv("QUERY_TEMPLATE_CACHE_SIZE", "128"))
+
+_IDENTIFIER_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+# Форми запитів. {label}/{rel_type} підставляються один раз при підготовці
+# шаблону (їх не можна параметризувати), решта значень — лише через $параметри.
+# {source}/{target} — необов'язкова мітка вузла за id (":Label" або порожньо).
+# Запити з такою міткою повертають matched — кількість знайдених кінців (вузлів за id),
+# щоб застарілу мітку можна було помітити (0); delete_link окремо рахує affected.
+SHAPES = {
+    "merge_node": "MERGE (n:{label} {{id: $id}}) SET n += $props",
+    "link_happened_at": (
+        "MATCH (n{source} {{id: $id}}), (d:Day {{id: $day_id}}) MERGE (n)-[:HAPPENED_AT {{time: $time}}]->(d) RETURN d.id AS day_id"
+    ),
+    "merge_node_at_day": (
+        "MATCH (d:Day {{id: $day_id}}) MERGE (n:{label} {{id: $id}}) SET n += $props "
+        "MERGE (n)-[:HAPPENED_AT {{time: $time}}]->(d) RETURN n.id AS id"
+    ),
+    "merge_link": "MATCH (s{source} {{id: $source_id}}), (t{target} {{id: $target_id}}) MERGE (s)-[r:{rel_type}]->(t) SET r += $props RETURN count(*) AS matched",
+    "clear_last_event": "MATCH (s:Session {{id: $session_id}})-[rel:LAST_EVENT]->() DELETE rel",
+    "set_last_event": "MATCH (s:Session {{id: $session_id}}), (last{target} {{id: $event_id}}) MERGE (s)-[:LAST_EVENT]->(last) RETURN count(*) AS matched",
+    "delete_node": "MATCH (n{source} {{id: $id}}) DETACH DELETE n RETURN count(*) AS matched",
+    "delete_link": (
+        "MATCH (s{source} {{id: $source_id}}), (t{target} {{id: $target_id}}) OPTIONAL MATCH (s)-[r:{rel_type}]->(t) "
+        "DELETE r RETURN count(DISTINCT s) AS matched, count(r) AS affected"
+    ),
+    "unwind_merge_nodes": "UNWIND $rows AS row MERGE (n:{label} {{id: row.id}}) SET n += row.props RETURN row.idx AS idx",
+    "unwind_happened_at": (
+        "MATCH (d:Day {{id: $day_id}}) UNWIND $rows AS row MATCH (n:{label} {{id: row.id}}) "
+        "MERGE (n)-[:HAPPENED_AT {{time: $time}}]->(d) RETURN row.idx AS idx"
+    ),
+    "unwind_merge_links": (
+        "UNWIND $rows AS row MATCH (s{source} {{id: row.source_id}}), (t{target} {{id: row.target_id}}) "
+        "MERGE (s)-[r:{rel_type}]->(t) SET r += row.props RETURN row.idx AS idx"
+    ),
+}
+
+
+def is_identifier(name) -> bool:
+    """Мітки та типи зв'язків не параметризуються, тому дозволяємо лише ідентифікатори."""
+    return isinstance(name, str) and bool(_IDENTIFIER_RE.match(name))
+
+
+def _map_key(key) -> str:
+    key = str(key)
+    return key if is_identifier(key) else "`" + key.replace("`", "``") + "`"
+
+
+def cypher_literal(value) -> str:
+    """Серіалізує значення параметра у Cypher-літерал для префікса CYPHER."""
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(cypher_literal(v) for v in value) + "]"
+    if isinstance(value, dict):
+        items = ", ".join(f"{_map_key(k)}: {cypher_literal(v)}" for k, v in value.items())
+        return "{" + items + "}"
+    escaped = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def with_params(query: str, **params) -> str:
+    """Додає до запиту префікс `CYPHER name=value ...`."""
+    if not params:
+        return query
+    prefix = " ".join(f"{name}={cypher_literal(value)}" for name, value in params.items())
+    return f"CYPHER {prefix} {query}"
+
+
+def stringify_props(props: dict, exclude=("id",)) -> dict:
+    """Значення властивостей зберігаються рядками — так само, як це робив e_str."""
+    return {k: ("" if v is None else str(v)) for k, v in (props or {}).items() if k not in exclude}
+
+
+def _scope(label: str) -> str:
+    if label is None:
+        return ""
+    if not is_identifier(label):
+        raise ValueError(f"Invalid node type: {label}")
+    return f":{label}"
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def prepare(shape: str, label: str = None, rel_type: str = None,
+            source_label: str = None, target_label: str = None) -> str:
+    """Повертає (і кешує) текст шаблону для форми з підставленими мітками/типом зв'язку."""
+    if shape not in SHAPES:
+        raise ValueError(f"Unknown query shape: {shape}")
+    if label is not None and not is_identifier(label):
+        raise ValueError(f"Invalid node type: {label}")
+    if rel_type is not None and not is_identifier(rel_type):
+        raise ValueError(f"Invalid relation type: {rel_type}")
+    return SHAPES[shape].format(label=label, rel_type=rel_type,
+                                source=_scope(source_label), target=_scope(target_label))
+
+
+def build(shape: str, label: str = None, rel_type: str = None,
+          source_label: str = None, target_label: str = None, **params) -> tuple:
+    """Повертає (template, query): стабільний шаблон та готовий запит з CYPHER-префіксом."""
+    template = prepare(shape, label=label, rel_type=rel_type, source_label=source_label, target_label=target_label)
+    return template, with_params(template, **params)
+
+
+def template_cache_info() -> dict:
+    info = prepare.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize}
@@ -0,0 +1,108 @@
+"""
+Кеш результатів read-only Cypher-запитів (query_graph та прямий бекенд Klim).
+
+Ключ — (граф, нормалізований текст запиту), витіснення LRU + TTL.
+Інструменти запису скидають кеш свого графа та збільшують лічильник
+поколінь графа в Redis (GRAPH_GENERATION_PREFIX:<graph>). Кеш в іншому
+процесі (llm-provider) звіряє покоління перед видачею запису, тож
+бачить записи MCP-сервера без окремого каналу інвалідації.
+Локальні invalidate() рахуються по графах: результат читання, під час якого
+граф скинули, не кешується (інакше старі рядки жили б до кінця TTL).
+"""
+import time
+from collections import OrderedDict
+
+from query_analysis import is_read_only, normalize_query
+
+GRAPH_GENERATION_PREFIX = "grynya:graph_generation"
+
+
+def generation_key(graph: str) -> str:
+    return f"{GRAPH_GENERATION_PREFIX}:{graph}"
+
+
+async def bump_generation(r, graph: str) -> int:
+    """Позначає граф як змінений для кешів інших процесів."""
+    return await r.incr(generation_key(graph))
+
+
+class QueryCache:
+    def __init__(self, max_entries: int = 512, ttl: float = 300.0, max_rows: int = 5000,
+                 check_generation: bool = False):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.check_generation = check_generation
+        self._entries = OrderedDict()  # (graph, query) -> (rows, expires_at, generation)
+        self._epochs = {}  # graph -> кількість invalidate(graph); ключ None — invalidate() усього кешу
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl > 0
+
+    async def _generation(self, r, graph: str):
+        if not self.check_generation:
+            return None
+        value = await r.get(generation_key(graph))
+        return int(value) if value is not None else 0
+
+    def _epoch(self, graph: str) -> tuple:
+        return self._epochs.get(None, 0), self._epochs.get(graph, 0)
+
+    async def get_or_run(self, r, graph: str, query: str, run) -> list:
+        """
+        Повертає закешовані рядки або виконує run() і кешує результат.
+        Запити із записом виконуються без кешу.
+        """
+        if not self.enabled or not is_read_only(query):
+            self.bypassed += 1
+            return await run()
+
+        key = (graph, normalize_query(query))
+        generation = await self._generation(r, graph)
+        entry = self._entries.get(key)
+        if entry is not None:
+            rows, expires_at, entry_generation = entry
+            if expires_at > time.monotonic() and entry_generation == generation:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return rows
+            del self._entries[key]
+
+        self.misses += 1
+        epoch = self._epoch(graph)
+        rows = await run()
+        if epoch != self._epoch(graph):
+            # Під час читання був запис — результат міг застаріти
+            return rows
+        if isinstance(rows, list) and len(rows) <= self.max_rows:
+            self._entries[key] = (rows, time.monotonic() + self.ttl, generation)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return rows
+
+    def invalidate(self, graph: str = None):
+        self.invalidations += 1
+        self._epochs[graph] = self._epochs.get(graph, 0) + 1
+        if graph is None:
+            self._entries.clear()
+            return
+        for key in [k for k in self._entries if k[0] == graph]:
+            del self._entries[key]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "bypassed": self.bypassed,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,124 @@
+"""
+Маршрутизація read-only запитів (GRAPH.RO_QUERY) на репліки FalkorDB.
+
+Записи завжди йдуть на primary. Читання розподіляються між репліками з
+FALKORDB_READ_REPLICAS ("host:port,host:port") за стратегією
+FALKORDB_READ_STRATEGY: round_robin або least_latency (EWMA затримки).
+Репліка, що не відповідає, виключається на FALKORDB_READ_COOLDOWN секунд,
+а запит повторюється на primary. Без реплік усі читання йдуть на primary.
+"""
+import itertools
+import logging
+import os
+import time
+
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import TimeoutError as RedisTimeoutError
+
+from db_client import FalkorClientManager
+
+logger = logging.getLogger("falkordb-client")
+
+STRATEGIES = ("round_robin", "least_latency")
+
+
+class _ReadNode:
+    def __init__(self, manager: FalkorClientManager, is_primary: bool = False):
+        self.manager = manager
+        self.is_primary = is_primary
+        self.latency_ms = None
+        self.down_until = 0.0
+        self.reads = 0
+        self.errors = 0
+
+    def observe(self, elapsed_ms: float, alpha: float):
+        self.latency_ms = elapsed_ms if self.latency_ms is None else alpha * elapsed_ms + (1 - alpha) * self.latency_ms
+
+    def stats(self) -> dict:
+        return {
+            "host": f"{self.manager.host}:{self.manager.port}",
+            "primary": self.is_primary,
+            "latency_ms": round(self.latency_ms, 2) if self.latency_ms is not None else None,
+            "available": self.down_until <= time.monotonic(),
+            "reads": self.reads,
+            "errors": self.errors,
+        }
+
+
+class ReadRouter:
+    def __init__(self, primary: FalkorClientManager, replicas: list = (), strategy: str = "round_robin",
+                 include_primary: bool = False, cooldown: float = 30.0, ewma_alpha: float = 0.3):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown read strategy: {strategy}")
+        self.primary = _ReadNode(primary, is_primary=True)
+        self.replicas = [_ReadNode(manager) for manager in replicas]
+        self.strategy = strategy
+        self.include_primary = include_primary or not self.replicas
+        self.cooldown = cooldown
+        self.ewma_alpha = ewma_alpha
+        self._round_robin = itertools.count()
+        self.failovers = 0
+
+    @classmethod
+    def from_env(cls, primary: FalkorClientManager, prefix: str = "FALKORDB"):
+        replicas = []
+        for spec in os.getenv(f"{prefix}_READ_REPLICAS", "").split(","):
+            spec = spec.strip()
+            if not spec:
+                continue
+            host, _, port = spec.partition(":")
+            replicas.append(FalkorClientManager.from_env(
+                prefix, host=host, port=int(port or primary.port), reconnect_attempts=1
+            ))
+        return cls(
+            primary,
+            replicas,
+            strategy=os.getenv(f"{prefix}_READ_STRATEGY", "round_robin"),
+            include_primary=os.getenv(f"{prefix}_READ_FROM_PRIMARY", "0") == "1",
+            cooldown=float(os.getenv(f"{prefix}_READ_COOLDOWN", "30")),
+        )
+
+    def _pick(self) -> _ReadNode:
+        nodes = self.replicas + ([self.primary] if self.include_primary and self.replicas else [])
+        now = time.monotonic()
+        available = [node for node in nodes if node.down_until <= now]
+        if not available:
+            return self.primary
+        if self.strategy == "least_latency":
+            # Ще не виміряні вузли мають пріоритет, щоб отримати першу оцінку
+            return min(available, key=lambda node: -1.0 if node.latency_ms is None else node.latency_ms)
+        return available[next(self._round_robin) % len(available)]
+
+    async def _run_on(self, node: _ReadNode, run):
+        client = await node.manager.get()
+        started = time.perf_counter()
+        result = await run(client)
+        node.observe((time.perf_counter() - started) * 1000, self.ewma_alpha)
+        node.reads += 1
+        return result
+
+    async def run(self, run):
+        """Виконує run(client) на обраному вузлі читання; при збої репліки — повтор на primary."""
+        node = self._pick()
+        if node.is_primary:
+            return await self._run_on(node, run)
+        try:
+            return await self._run_on(node, run)
+        except (RedisConnectionError, RedisTimeoutError, OSError) as e:
+            node.errors += 1
+            node.down_until = time.monotonic() + self.cooldown
+            self.failovers += 1
+            logger.warning(f"Read replica {node.manager.host}:{node.manager.port} failed, using primary: {e}")
+            await node.manager.reset()
+            return await self._run_on(self.primary, run)
+
+    def stats(self) -> dict:
+        return {
+            "strategy": self.strategy,
+            "failovers": self.failovers,
+            "nodes": [node.stats() for node in self.replicas + [self.primary]],
+        }
+
+    async def close(self):
+        for node in self.replicas:
+            await node.manager.close()
@@ -0,0 +1,223 @@
+"""
+Перетворення відповідей GRAPH.QUERY у список словників (рядки результату).
+
+Два режими:
+  * verbose — стандартна відповідь FalkorDB, де вузли/зв'язки приходять як
+    [['id', ..], ['labels', ..], ['properties', [[k, v], ...]]];
+  * compact — відповідь `GRAPH.QUERY ... --compact`, де мітки, типи зв'язків
+    та ключі властивостей передаються числовими id. Імена підставляються з
+    кешу схеми графа (db.labels()/db.relationshipTypes()/db.propertyKeys()),
+    а рядки декодуються в словники за один прохід.
+"""
+
+# Типи значень compact-протоколу FalkorDB
+VALUE_UNKNOWN = 0
+VALUE_NULL = 1
+VALUE_STRING = 2
+VALUE_INTEGER = 3
+VALUE_BOOLEAN = 4
+VALUE_DOUBLE = 5
+VALUE_ARRAY = 6
+VALUE_EDGE = 7
+VALUE_NODE = 8
+VALUE_PATH = 9
+VALUE_MAP = 10
+VALUE_POINT = 11
+VALUE_VECTORF32 = 12
+
+
+def decode_falkor(item):
+    if isinstance(item, bytes):
+        try:
+            return item.decode('utf-8')
+        except:
+            return str(item)
+    elif isinstance(item, list):
+        return [decode_falkor(i) for i in item]
+    elif isinstance(item, dict):
+        return {decode_falkor(k): decode_falkor(v) for k, v in item.items()}
+    else:
+        return item
+
+
+def format_falkordb_results(res):
+    res_decoded = decode_falkor(res)
+    if len(res_decoded) < 3:
+        return []
+
+    headers = res_decoded[0]
+    data = res_decoded[1]
+
+    formatted_data = []
+    if not isinstance(headers, list) or not isinstance(data, list):
+        return []
+
+    for row in data:
+        row_dict = {}
+        for idx, col_name in enumerate(headers):
+            val = row[idx]
+
+            # check if it's a node or edge
+            is_graph_entity = False
+            if isinstance(val, list) and len(val) > 0 and isinstance(val[0], list) and len(val[0]) == 2 and val[0][0] == 'id':
+                is_graph_entity = True
+
+            if is_graph_entity:
+                obj_dict = {}
+                for prop_pair in val:
+                    if isinstance(prop_pair, list) and len(prop_pair) == 2:
+                        k, v = prop_pair
+                        if k == 'properties' and isinstance(v, list):
+                            props_dict = {}
+                            for p in v:
+                                if isinstance(p, list) and len(p) == 2:
+                                    props_dict[p[0]] = p[1]
+                            obj_dict[k] = props_dict
+                        else:
+                            obj_dict[k] = v
+                row_dict[col_name] = obj_dict
+            else:
+                row_dict[col_name] = val
+        formatted_data.append(row_dict)
+    return formatted_data
+
+
+class SchemaMiss(Exception):
+    """У compact-відповіді трапився id мітки/типу/ключа, якого ще немає в кеші."""
+
+
+def _text(value) -> str:
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    return value
+
+
+class GraphSchema:
+    """Відображення числових id compact-протоколу на імена для одного графа."""
+
+    __slots__ = ("labels", "relationship_types", "property_keys")
+
+    def __init__(self, labels=(), relationship_types=(), property_keys=()):
+        self.labels = list(labels)
+        self.relationship_types = list(relationship_types)
+        self.property_keys = list(property_keys)
+
+    @staticmethod
+    def _lookup(names: list, idx: int, strict: bool) -> str:
+        if 0 <= idx < len(names):
+            return names[idx]
+        if strict:
+            raise SchemaMiss(idx)
+        return f"#{idx}"
+
+
+class GraphSchemaCache:
+    """Кеш схем (labels / relationship types / property keys) по назві графа."""
+
+    def __init__(self):
+        self._schemas = {}
+
+    def get(self, graph: str):
+        return self._schemas.get(graph)
+
+    def invalidate(self, graph: str = None):
+        if graph is None:
+            self._schemas.clear()
+        else:
+            self._schemas.pop(graph, None)
+
+    async def refresh(self, r, graph: str) -> GraphSchema:
+        async def names(procedure: str) -> list:
+            res = await r.execute_command("GRAPH.RO_QUERY", graph, f"CALL {procedure}()")
+            if not isinstance(res, list) or len(res) < 3:
+                return []
+            return [_text(row[0]) for row in res[1]]
+
+        schema = GraphSchema(
+            labels=await names("db.labels"),
+            relationship_types=await names("db.relationshipTypes"),
+            property_keys=await names("db.propertyKeys"),
+        )
+        self._schemas[graph] = schema
+        return schema
+
+
+def _decode_props(props, schema: GraphSchema, strict: bool) -> dict:
+    keys = schema.property_keys
+    return {
+        GraphSchema._lookup(keys, key_id, strict): _decode_value(value_type, value, schema, strict)
+        for key_id, value_type, value in props
+    }
+
+
+def _decode_value(value_type, value, schema: GraphSchema, strict: bool):
+    if value_type == VALUE_STRING:
+        return _text(value)
+    if value_type == VALUE_INTEGER or value_type == VALUE_NULL:
+        return value
+    if value_type == VALUE_BOOLEAN:
+        return _text(value) == "true"
+    if value_type == VALUE_DOUBLE:
+        return float(value)
+    if value_type == VALUE_NODE:
+        node_id, label_ids, props = value
+        return {
+            "id": node_id,
+            "labels": [GraphSchema._lookup(schema.labels, l, strict) for l in label_ids],
+            "properties": _decode_props(props, schema, strict),
+        }
+    if value_type == VALUE_EDGE:
+        edge_id, type_id, src_id, dest_id, props = value
+        return {
+            "id": edge_id,
+            "type": GraphSchema._lookup(schema.relationship_types, type_id, strict),
+            "src_node": src_id,
+            "dest_node": dest_id,
+            "properties": _decode_props(props, schema, strict),
+        }
+    if value_type == VALUE_ARRAY:
+        return [_decode_value(t, v, schema, strict) for t, v in value]
+    if value_type == VALUE_PATH:
+        nodes, edges = value
+        return {
+            "nodes": _decode_value(nodes[0], nodes[1], schema, strict),
+            "edges": _decode_value(edges[0], edges[1], schema, strict),
+        }
+    if value_type == VALUE_MAP:
+        return {
+            _text(value[i]): _decode_value(value[i + 1][0], value[i + 1][1], schema, strict)
+            for i in range(0, len(value), 2)
+        }
+    if value_type == VALUE_POINT:
+        return {"latitude": float(value[0]), "longitude": float(value[1])}
+    if value_type == VALUE_VECTORF32:
+        return [float(v) for v in value]
+    return decode_falkor(value)
+
+
+def decode_compact(res, schema: GraphSchema, strict: bool = True) -> list:
+    """
+    Декодує compact-відповідь у список словників за один прохід.
+    strict=True піднімає SchemaMiss на невідомому id (щоб оновити кеш схеми).
+    """
+    if not isinstance(res, list) or len(res) < 3:
+        return []
+    headers = [_text(column[1]) for column in res[0]]
+    return [
+        dict(zip(headers, [_decode_value(cell[0], cell[1], schema, strict) for cell in row]))
+        for row in res[1]
+    ]
+
+
+async def query_compact(r, graph: str, query: str, schema_cache: GraphSchemaCache,
+                        command: str = "GRAPH.QUERY", extra_args=()) -> list:
+    """Виконує запит з --compact та декодує його, оновлюючи кеш схеми при промаху."""
+    res = await r.execute_command(command, graph, query, "--compact", *extra_args)
+    schema = schema_cache.get(graph)
+    if schema is None:
+        schema = await schema_cache.refresh(r, graph)
+    try:
+        return decode_compact(res, schema)
+    except SchemaMiss:
+        schema = await schema_cache.refresh(r, graph)
+        return decode_compact(res, schema, strict=False)
@@ -0,0 +1,174 @@
+"""
+Канал задач Klim на Redis Streams.
+
+Видавець (init_session_with_context) додає задачу XADD у потік
+KLIM_TASK_STREAM; воркери llm-provider читають її через consumer group
+(XREADGROUP), тож кожну задачу отримує рівно один воркер, а задачі, додані
+поки воркер перепідключався, не губляться. Після обробки задача
+підтверджується XACK; задачі впалого воркера забирає інший через XAUTOCLAIM.
+Поки задача в черзі чи виконується, воркер періодично оновлює її запис
+(XCLAIM ... JUSTID), тож XAUTOCLAIM не забирає живу задачу навіть якщо вона
+довша за claim_idle_ms.
+Результат кладеться в список klim:results:<task_id> (RPUSH + EXPIRE), який
+видавець читає BLPOP короткими відрізками (не впираючись у socket_timeout пулу).
+"""
+import json
+import logging
+import os
+import time
+
+from redis.exceptions import ResponseError
+
+logger = logging.getLogger("falkordb-client")
+
+TASK_STREAM = os.getenv("KLIM_TASK_STREAM", "klim:tasks:stream")
+TASK_GROUP = os.getenv("KLIM_TASK_GROUP", "klim-workers")
+RESULT_KEY_PREFIX = "klim:results"
+STREAM_MAXLEN = int(os.getenv("KLIM_TASK_STREAM_MAXLEN", "10000"))
+RESULT_TTL = int(os.getenv("KLIM_RESULT_TTL", "3600"))
+
+
+def result_key(task_id: str) -> str:
+    return f"{RESULT_KEY_PREFIX}:{task_id}"
+
+
+def _text(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+async def publish_task(r, payload: dict, stream: str = TASK_STREAM) -> str:
+    """Додає задачу в потік, повертає id запису."""
+    message_id = await r.xadd(stream, {"data": json.dumps(payload)}, maxlen=STREAM_MAXLEN, approximate=True)
+    return _text(message_id)
+
+
+async def deliver_result(r, task_id: str, payload: dict, ttl: int = RESULT_TTL):
+    key = result_key(task_id)
+    await r.rpush(key, json.dumps(payload))
+    await r.expire(key, ttl)
+
+
+async def wait_result(r, task_id: str, timeout: float, chunk: float = 1.0):
+    """Чекає результат задачі не довше timeout секунд. None — результату ще немає."""
+    deadline = time.monotonic() + timeout
+    key = result_key(task_id)
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        item = await r.blpop([key], timeout=max(0.01, min(chunk, remaining)))
+        if item is not None:
+            return json.loads(_text(item[1]))
+
+
+class TaskStreamConsumer:
+    """Читач потоку задач у складі consumer group."""
+
+    def __init__(self, consumer: str, stream: str = TASK_STREAM, group: str = TASK_GROUP,
+                 block_ms: int = 1000, claim_idle_ms: int = 600000, claim_interval: float = 30.0):
+        self.consumer = consumer
+        self.stream = stream
+        self.group = group
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.claim_interval = claim_interval
+        self._next_claim = 0.0
+        self._next_touch = 0.0
+        self._active = set()  # id записів, що стоять у черзі диспетчера або виконуються
+        self.read_count = 0
+        self.claimed_count = 0
+        self.acked_count = 0
+
+    @classmethod
+    def from_env(cls, consumer: str):
+        return cls(
+            consumer,
+            block_ms=int(os.getenv("KLIM_STREAM_BLOCK_MS", "1000")),
+            # Має перевищувати найдовший дедлайн задачі (KLIM_ASYNC_CONTEXT_TIMEOUT, 300 с)
+            claim_idle_ms=int(os.getenv("KLIM_STREAM_CLAIM_IDLE_MS", "600000")),
+            claim_interval=float(os.getenv("KLIM_STREAM_CLAIM_INTERVAL", "30")),
+        )
+
+    async def ensure_group(self, r):
+        """Створює групу (разом з потоком) з початку потоку; наявна група — не помилка."""
+        try:
+            await r.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+            logger.info(f"Created consumer group {self.group} on {self.stream}")
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    @staticmethod
+    def _decode(entries) -> list:
+        decoded = []
+        for message_id, fields in entries or []:
+            if fields is None:
+                continue
+            fields = {_text(k): _text(v) for k, v in fields.items()}
+            try:
+                payload = json.loads(fields.get("data", ""))
+            except ValueError:
+                payload = None
+            decoded.append((_text(message_id), payload))
+        return decoded
+
+    async def claim_stale(self, r, count: int) -> list:
+        """Раз на claim_interval забирає задачі, що зависли у pending інших воркерів довше claim_idle_ms."""
+        if count <= 0 or time.monotonic() < self._next_claim:
+            return []
+        self._next_claim = time.monotonic() + self.claim_interval
+        res = await r.xautoclaim(self.stream, self.group, self.consumer, self.claim_idle_ms, "0-0", count=count)
+        # Власні задачі, що ще в роботі, не беремо вдруге
+        entries = [entry for entry in self._decode(res[1] if len(res) > 1 else []) if entry[0] not in self._active]
+        if entries:
+            self.claimed_count += len(entries)
+            logger.warning(f"Reclaimed {len(entries)} stale Klim tasks")
+        return entries
+
+    async def read(self, r, count: int, pending: bool = False) -> list:
+        """
+        Нові задачі для цього воркера: [(message_id, payload або None, якщо запис пошкоджений)].
+        pending=True — натомість власні непідтверджені задачі (після перезапуску воркера).
+        """
+        if count <= 0:
+            return []
+        if pending:
+            res = await r.xreadgroup(self.group, self.consumer, {self.stream: "0"}, count=count)
+        else:
+            res = await r.xreadgroup(self.group, self.consumer, {self.stream: ">"}, count=count, block=self.block_ms)
+        entries = []
+        for _, stream_entries in res or []:
+            entries.extend(self._decode(stream_entries))
+        self.read_count += len(entries)
+        return entries
+
+    def track(self, message_id: str):
+        """Запис прийнятий у роботу: до ack він оновлюється в keep_alive та не береться повторно."""
+        self._active.add(message_id)
+
+    async def keep_alive(self, r):
+        """Раз на claim_interval скидає idle-час записів у роботі (XCLAIM ... JUSTID на себе)."""
+        if not self._active or time.monotonic() < self._next_touch:
+            return
+        self._next_touch = time.monotonic() + self.claim_interval
+        await r.xclaim(self.stream, self.group, self.consumer, 0, list(self._active), justid=True)
+
+    async def ack(self, r, message_id: str):
+        self._active.discard(message_id)
+        await r.xack(self.stream, self.group, message_id)
+        self.acked_count += 1
+
+    async def pending(self, r) -> int:
+        info = await r.xpending(self.stream, self.group)
+        return info.get("pending", 0) if isinstance(info, dict) else 0
+
+    def stats(self) -> dict:
+        return {
+            "stream": self.stream,
+            "group": self.group,
+            "consumer": self.consumer,
+            "read": self.read_count,
+            "claimed": self.claimed_count,
+            "acked": self.acked_count,
+            "active": len(self._active),
+        }
@@ -0,0 +1,98 @@
+"""
+Атомарний набір записів у граф.
+
+WriteSet збирає MATCH/MERGE-фрагменти і компілює їх в ОДИН параметризований
+Cypher-запит. FalkorDB виконує запит атомарно, тож набір або записується
+повністю, або не записується зовсім — без напівзаписаних сесій — і коштує
+один round trip замість окремого GRAPH.QUERY на кожен вузол/зв'язок.
+"""
+from query_builder import is_identifier, with_params
+
+
+class WriteSetError(Exception):
+    """Набір записів не застосовано (помилка FalkorDB або не знайдено обов'язковий вузол)."""
+
+    def __init__(self, message: str, query: str = None):
+        super().__init__(message)
+        self.query = query
+
+
+class WriteSet:
+    def __init__(self):
+        self._matches = []
+        self._writes = []
+        self._params = {}
+        self._vars = set()
+
+    def _param(self, value) -> str:
+        name = f"p{len(self._params)}"
+        self._params[name] = value
+        return f"${name}"
+
+    def _pattern_props(self, props: dict) -> str:
+        for key in props:
+            if not is_identifier(key):
+                raise ValueError(f"Invalid property key: {key}")
+        return ", ".join(f"{key}: {self._param(value)}" for key, value in props.items())
+
+    def _bind(self, var: str, label: str):
+        if not is_identifier(var):
+            raise ValueError(f"Invalid variable: {var}")
+        if not is_identifier(label):
+            raise ValueError(f"Invalid node type: {label}")
+        if var in self._vars:
+            raise ValueError(f"Variable already bound: {var}")
+        self._vars.add(var)
+
+    def __contains__(self, var: str) -> bool:
+        return var in self._vars
+
+    def match_node(self, var: str, label: str, node_id: str) -> "WriteSet":
+        """Обов'язковий існуючий вузол: якщо його немає, весь набір не застосовується."""
+        self._bind(var, label)
+        self._matches.append(f"({var}:{label} {{id: {self._param(node_id)}}})")
+        return self
+
+    def merge_node(self, var: str, label: str, node_id: str, props: dict = None, key_props: dict = None) -> "WriteSet":
+        """MERGE за id (та key_props, якщо задано) з подальшим SET var += props."""
+        self._bind(var, label)
+        key = self._pattern_props({"id": node_id, **(key_props or {})})
+        clause = f"MERGE ({var}:{label} {{{key}}})"
+        if props:
+            clause += f" SET {var} += {self._param(props)}"
+        self._writes.append(clause)
+        return self
+
+    def merge_edge(self, source_var: str, rel_type: str, target_var: str, props: dict = None) -> "WriteSet":
+        if not is_identifier(rel_type):
+            raise ValueError(f"Invalid relation type: {rel_type}")
+        for var in (source_var, target_var):
+            if var not in self._vars:
+                raise ValueError(f"Unbound variable: {var}")
+        pattern = f" {{{self._pattern_props(props)}}}" if props else ""
+        self._writes.append(f"MERGE ({source_var})-[:{rel_type}{pattern}]->({target_var})")
+        return self
+
+    def compile(self) -> tuple:
+        """Повертає (template, query). Для однакової форми набору текст шаблону однаковий."""
+        if not self._writes:
+            raise ValueError("Empty write set")
+        parts = []
+        if self._matches:
+            parts.append("MATCH " + ", ".join(self._matches))
+        parts.extend(self._writes)
+        parts.append("RETURN 1 AS ok")
+        template = " ".join(parts)
+        return template, with_params(template, **self._params)
+
+    async def commit(self, r, graph: str) -> str:
+        """Виконує набір одним запитом. Повертає текст шаблону; при невдачі піднімає WriteSetError."""
+        template, query = self.compile()
+        try:
+            res = await r.execute_command("GRAPH.QUERY", graph, query)
+        except Exception as e:
+            raise WriteSetError(str(e), template) from e
+        rows = res[1] if isinstance(res, list) and len(res) >= 3 else []
+        if not rows:
+            raise WriteSetError("Required node not found, nothing was written", template)
+        return template
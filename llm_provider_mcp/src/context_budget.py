@@ -0,0 +1,144 @@
+"""
+Бюджет контексту агентного циклу Klim.
+
+Gemini отримує весь `contents` на кожній ітерації, тож великі результати
+query_graph множаться на кількість ітерацій. Тут:
+  * fit_result — обрізає один результат інструмента до ліміту рядків/байтів
+    (голова вибірки + рівномірна вибірка з решти, маркер "truncated, N more rows");
+  * compact — коли весь payload перевищує поріг, старі functionResponse
+    замінюються коротким зведенням (останні ходи лишаються без змін).
+"""
+import json
+import os
+
+
+def _size(value) -> int:
+    return len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+
+class ContextBudget:
+    def __init__(self, max_result_bytes: int = 16000, max_rows: int = 50, max_value_chars: int = 1000,
+                 max_context_bytes: int = 120000, keep_recent_turns: int = 2, preview_rows: int = 3):
+        self.max_result_bytes = max_result_bytes
+        self.max_rows = max(1, max_rows)
+        self.max_value_chars = max_value_chars
+        self.max_context_bytes = max_context_bytes
+        self.keep_recent_turns = keep_recent_turns
+        self.preview_rows = preview_rows
+        self.truncated_results = 0
+        self.compacted_parts = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_result_bytes=int(os.getenv("AGENT_RESULT_MAX_BYTES", "16000")),
+            max_rows=int(os.getenv("AGENT_RESULT_MAX_ROWS", "50")),
+            max_value_chars=int(os.getenv("AGENT_RESULT_MAX_VALUE_CHARS", "1000")),
+            max_context_bytes=int(os.getenv("AGENT_CONTEXT_MAX_BYTES", "120000")),
+            keep_recent_turns=int(os.getenv("AGENT_KEEP_RECENT_TURNS", "2")),
+        )
+
+    def _clip_value(self, value):
+        if isinstance(value, str) and len(value) > self.max_value_chars:
+            return value[:self.max_value_chars] + f"… [+{len(value) - self.max_value_chars} chars]"
+        if isinstance(value, dict):
+            return {k: self._clip_value(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._clip_value(v) for v in value]
+        return value
+
+    def _sample(self, rows: list, limit: int) -> list:
+        """Перша половина ліміту — голова вибірки, решта — рівномірно з хвоста."""
+        if len(rows) <= limit:
+            return list(rows)
+        head = rows[:max(1, limit // 2)]
+        rest = rows[len(head):]
+        picks = limit - len(head)
+        step = len(rest) / picks if picks else 0
+        return head + [rest[int(i * step)] for i in range(picks)]
+
+    def _fit_rows(self, rows: list, max_bytes: int) -> tuple:
+        """Повертає (вибрані рядки, кількість відкинутих)."""
+        kept = [self._clip_value(row) for row in self._sample(rows, self.max_rows)]
+        while kept and _size(kept) > max_bytes:
+            kept = kept[:max(0, len(kept) * 3 // 4)] if len(kept) > 4 else kept[:-1]
+        return kept, len(rows) - len(kept)
+
+    def fit_result(self, result_text: str) -> str:
+        """Обрізає JSON-результат query_graph під max_result_bytes з маркером обрізання."""
+        if len(result_text.encode("utf-8")) <= self.max_result_bytes:
+            return result_text
+        try:
+            data = json.loads(result_text)
+        except (TypeError, ValueError):
+            data = None
+
+        results = data.get("results") if isinstance(data, dict) else None
+        if isinstance(results, list):
+            kept, dropped = self._fit_rows(results, self.max_result_bytes - 256)
+            data["results"] = kept
+            if dropped:
+                data["truncated"] = f"truncated, {dropped} more rows (of {len(results)})"
+        elif isinstance(results, dict):
+            per_graph = (self.max_result_bytes - 256) // max(1, len(results))
+            notes = {}
+            for graph_name, rows in results.items():
+                if isinstance(rows, list):
+                    kept, dropped = self._fit_rows(rows, per_graph)
+                    results[graph_name] = kept
+                    if dropped:
+                        notes[graph_name] = f"truncated, {dropped} more rows (of {len(rows)})"
+            if notes:
+                data["truncated"] = notes
+        else:
+            raw = result_text.encode("utf-8")
+            self.truncated_results += 1
+            head = raw[:self.max_result_bytes].decode("utf-8", errors="ignore")
+            return f"{head}… [truncated, {len(raw) - self.max_result_bytes} more bytes]"
+
+        self.truncated_results += 1
+        return json.dumps(data, ensure_ascii=False)
+
+    def _summarize(self, result_text: str) -> str:
+        try:
+            data = json.loads(result_text)
+        except (TypeError, ValueError):
+            return result_text[:200] + "… [compacted]"
+        if not isinstance(data, dict):
+            return json.dumps({"compacted": True}, ensure_ascii=False)
+        results = data.get("results")
+        summary = {"status": data.get("status"), "compacted": True}
+        if isinstance(results, list):
+            summary["rows"] = len(results)
+            summary["preview"] = [self._clip_value(r) for r in results[:self.preview_rows]]
+        elif isinstance(results, dict):
+            summary["rows"] = {g: len(r) if isinstance(r, list) else r for g, r in results.items()}
+        elif "message" in data:
+            summary["message"] = str(data["message"])[:200]
+        return json.dumps(summary, ensure_ascii=False)
+
+    def compact(self, contents: list) -> int:
+        """
+        Стискає старі functionResponse, доки payload не вкладеться в max_context_bytes.
+        Останні keep_recent_turns ходів з відповідями інструментів не чіпаються. Повертає кількість стиснутих частин.
+        """
+        if _size(contents) <= self.max_context_bytes:
+            return 0
+        response_turns = [
+            msg for msg in contents
+            if msg.get("role") == "user" and any("functionResponse" in p for p in msg.get("parts", []))
+        ]
+        older = response_turns[:-self.keep_recent_turns] if self.keep_recent_turns else response_turns
+        compacted = 0
+        for msg in older:
+            for part in msg["parts"]:
+                response = part.get("functionResponse", {}).get("response")
+                if not response or response.get("compacted"):
+                    continue
+                response["result"] = self._summarize(response.get("result", ""))
+                response["compacted"] = True
+                compacted += 1
+            if _size(contents) <= self.max_context_bytes:
+                break
+        self.compacted_parts += compacted
+        return compacted
@@ -0,0 +1,156 @@
+"""
+Кеш OAuth-облікових даних Gemini.
+
+Токен читається з GEMINI_TOKEN_PATH один раз і тримається в пам'яті.
+Оновлення (refresh) відбувається у фоні за GEMINI_TOKEN_REFRESH_MARGIN секунд
+до закінчення терміну дії, а виклик на шляху запиту чекає лише тоді, коли
+токен уже прострочений або спливає протягом хвилини. Одночасні виклики не дублюють refresh (single-flight:
+перевірка під lock, тож до token endpoint іде один запит). Оновлений токен
+атомарно зберігається назад у файл (тимчасовий файл + os.replace). Якщо файл
+замінили ззовні (наприклад, auth.py), нова версія підхоплюється при наступному
+оновленні.
+"""
+import asyncio
+import datetime
+import logging
+import os
+import threading
+
+logger = logging.getLogger("llm-provider-mcp")
+
+# Запас терміну дії токена, з яким його ще віддають на шлях запиту (секунди)
+REQUEST_MARGIN = 60.0
+
+
+class GeminiCredentials:
+    def __init__(self, token_path: str, refresh_margin: float = 300.0, retry_interval: float = 30.0):
+        self.token_path = token_path
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self._creds = None
+        self._mtime = None
+        self._lock = threading.Lock()
+        self._refresher = None
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.loads = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.environ.get("GEMINI_TOKEN_PATH", "credentials/token.json"),
+            refresh_margin=float(os.getenv("GEMINI_TOKEN_REFRESH_MARGIN", "300")),
+            retry_interval=float(os.getenv("GEMINI_TOKEN_RETRY_INTERVAL", "30")),
+        )
+
+    def available(self) -> bool:
+        return self._creds is not None or os.path.exists(self.token_path)
+
+    def _seconds_left(self, creds) -> float:
+        if creds.expiry is None:
+            return float("inf")
+        # google-auth зберігає expiry як naive UTC
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return (creds.expiry - now).total_seconds()
+
+    def _fresh(self, creds, margin: float) -> bool:
+        return creds is not None and creds.token is not None and self._seconds_left(creds) > margin
+
+    def _load(self):
+        from google.oauth2.credentials import Credentials
+        if not os.path.exists(self.token_path):
+            raise FileNotFoundError(f"Token file not found at {self.token_path}")
+        mtime = os.path.getmtime(self.token_path)
+        if self._creds is None or mtime != self._mtime:
+            self._creds = Credentials.from_authorized_user_file(self.token_path)
+            self._mtime = mtime
+            self.loads += 1
+
+    def _persist(self, creds):
+        directory = os.path.dirname(os.path.abspath(self.token_path))
+        tmp = os.path.join(directory, f".{os.path.basename(self.token_path)}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            f.write(creds.to_json())
+        try:
+            os.chmod(tmp, os.stat(self.token_path).st_mode & 0o777)
+        except OSError:
+            pass
+        os.replace(tmp, self.token_path)
+        self._mtime = os.path.getmtime(self.token_path)
+
+    def _ensure(self, margin: float):
+        """Блокуюча частина: завантаження/refresh під lock — лише один потік іде до token endpoint."""
+        with self._lock:
+            if self._fresh(self._creds, margin):
+                return self._creds
+            self._load()
+            if self._fresh(self._creds, margin):
+                return self._creds
+            if not self._creds.refresh_token:
+                return self._creds
+            from google.auth.transport.requests import Request
+            try:
+                self._creds.refresh(Request())
+            except Exception:
+                self.refresh_errors += 1
+                raise
+            self.refreshes += 1
+            try:
+                self._persist(self._creds)
+            except OSError as e:
+                logger.warning(f"[credentials] Failed to persist refreshed token: {e}")
+            return self._creds
+
+    def _ensure_refresher(self):
+        if self._refresher is not None and not self._refresher.done():
+            return
+        self._refresher = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        while True:
+            creds = self._creds
+            delay = self.retry_interval
+            if creds is not None:
+                delay = max(0.0, self._seconds_left(creds) - self.refresh_margin)
+                if delay == float("inf"):
+                    return
+            await asyncio.sleep(delay)
+            try:
+                await asyncio.to_thread(self._ensure, self.refresh_margin)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"[credentials] Background token refresh failed: {e}")
+                await asyncio.sleep(self.retry_interval)
+                continue
+            if not self._fresh(self._creds, self.refresh_margin):
+                # Оновити не вдалося (немає refresh_token або короткий термін) — не крутимо цикл
+                await asyncio.sleep(self.retry_interval)
+
+    async def get(self):
+        """Актуальні облікові дані; швидкий шлях — без звернення до файлу чи мережі."""
+        margin = min(REQUEST_MARGIN, self.refresh_margin)
+        creds = self._creds
+        if not self._fresh(creds, margin):
+            creds = await asyncio.to_thread(self._ensure, margin)
+        self._ensure_refresher()
+        return creds
+
+    async def token(self) -> str:
+        return (await self.get()).token
+
+    async def stop(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            await asyncio.gather(self._refresher, return_exceptions=True)
+            self._refresher = None
+
+    def stats(self) -> dict:
+        creds = self._creds
+        return {
+            "loaded": creds is not None,
+            "expires_in": round(self._seconds_left(creds), 1) if creds is not None else None,
+            "loads": self.loads,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+        }
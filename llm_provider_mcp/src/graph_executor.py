@@ -0,0 +1,167 @@
+"""
+Виконавці Cypher-запитів для агентного циклу Klim.
+
+  * MCPGraphExecutor — інструмент query_graph на grynya-mcp-server через пул MCP-сесій;
+  * DirectGraphExecutor — напряму в FalkorDB (redis.asyncio, читання через GRAPH.RO_QUERY
+    та read_router) зі спільними модулями falkordb-service/mcp, без MCP/SSE та зайвих
+    серіалізацій. Запити із записом, а також випадки, коли FalkorDB недоступна,
+    передаються MCP-бекенду — так записи проходять через інвалідацію кешів сервера.
+
+Обидва повертають той самий JSON-текст, що й інструмент query_graph.
+Бекенд обирається змінною KLIM_GRAPH_BACKEND ("direct" або "mcp").
+"""
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+import graph_query
+from db_client import FalkorClientManager
+from query_analysis import is_read_only
+from query_cache import QueryCache
+from read_router import ReadRouter
+from result_formatter import GraphSchemaCache
+
+logger = logging.getLogger("llm-provider-mcp")
+
+
+class GraphExecutor(ABC):
+    name = "base"
+
+    @abstractmethod
+    async def query(self, query: str, graphs: list = None) -> str:
+        """Виконує запит та повертає JSON-текст у форматі інструменту query_graph."""
+
+    def stats(self) -> dict:
+        return {}
+
+    async def close(self):
+        pass
+
+
+class MCPGraphExecutor(GraphExecutor):
+    name = "mcp"
+
+    def __init__(self, get_pool):
+        self._get_pool = get_pool
+
+    async def query(self, query: str, graphs: list = None) -> str:
+        arguments = {"query": query, "graphs": graphs} if graphs else {"query": query}
+        result = await self._get_pool().call_tool("query_graph", arguments)
+        return result.content[0].text if result.content else "{}"
+
+
+class DirectGraphExecutor(GraphExecutor):
+    name = "direct"
+
+    def __init__(self, default_graph: str, fallback: GraphExecutor = None, compact: bool = True,
+                 concurrency: int = 4, timeout: float = 20.0, cache: QueryCache = None,
+                 manager: FalkorClientManager = None):
+        self.default_graph = default_graph
+        self.fallback = fallback
+        self.schema_cache = GraphSchemaCache() if compact else None
+        # Записи робить MCP-сервер, тож свіжість кешу звіряється з поколінням графа в Redis
+        self.cache = cache or QueryCache(max_entries=0)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        # Пул primary спільний з рештою процесу (закриває власник); свій — лише якщо не передано
+        self.manager = manager
+        self._owns_manager = manager is None
+        self._router = None
+        self.direct_queries = 0
+        self.fallback_queries = 0
+
+    @classmethod
+    def from_env(cls, fallback: GraphExecutor = None, manager: FalkorClientManager = None):
+        return cls(
+            default_graph=os.getenv("GRAPH_NAME", "Grynya"),
+            fallback=fallback,
+            compact=os.getenv("FALKORDB_COMPACT_RESULTS", "1") == "1",
+            concurrency=int(os.getenv("QUERY_FANOUT_CONCURRENCY", "4")),
+            timeout=float(os.getenv("QUERY_GRAPH_TIMEOUT", "20")),
+            cache=QueryCache(
+                max_entries=int(os.getenv("QUERY_CACHE_SIZE", "512")),
+                ttl=float(os.getenv("QUERY_CACHE_TTL", "300")),
+                max_rows=int(os.getenv("QUERY_CACHE_MAX_ROWS", "5000")),
+                check_generation=True,
+            ),
+            manager=manager,
+        )
+
+    async def _run(self, r, router: ReadRouter, graph_name: str, query: str, timeout_ms: int = None) -> list:
+        if not is_read_only(query):
+            return await graph_query.run_query(r, graph_name, query, self.schema_cache, timeout_ms)
+        return await self.cache.get_or_run(r, graph_name, query, lambda: router.run(
+            lambda reader: graph_query.run_query(
+                reader, graph_name, query, self.schema_cache, timeout_ms, command="GRAPH.RO_QUERY"
+            )
+        ))
+
+    def stats(self) -> dict:
+        return {
+            "direct_queries": self.direct_queries,
+            "fallback_queries": self.fallback_queries,
+            "query_cache": self.cache.stats(),
+            "read_routing": self._router.stats() if self._router is not None else None,
+        }
+
+    def _get_router(self) -> ReadRouter:
+        if self._router is None:
+            if self.manager is None:
+                self.manager = FalkorClientManager.from_env()
+            self._router = ReadRouter.from_env(self.manager)
+        return self._router
+
+    async def close(self):
+        if self._router is not None:
+            await self._router.close()
+            self._router = None
+        if self._owns_manager and self.manager is not None:
+            await self.manager.close()
+            self.manager = None
+
+    async def query(self, query: str, graphs: list = None) -> str:
+        if self.fallback is not None and not is_read_only(query):
+            self.fallback_queries += 1
+            return await self.fallback.query(query, graphs)
+
+        target_graphs = graphs if graphs else [self.default_graph]
+        router = self._get_router()
+        manager = router.primary.manager
+        try:
+            r = await manager.get()
+        except Exception as e:
+            if self.fallback is None:
+                return json.dumps({"status": "error", "message": str(e)})
+            logger.warning(f"[graph_executor] FalkorDB unavailable, falling back to {self.fallback.name}: {e}")
+            self.fallback_queries += 1
+            return await self.fallback.query(query, graphs)
+
+        self.direct_queries += 1
+        try:
+            if len(target_graphs) == 1:
+                formatted = await self._run(r, router, target_graphs[0], query)
+                return json.dumps({"status": "success", "graph": target_graphs[0], "results": formatted})
+            combined, latency_ms = await graph_query.fan_out(
+                lambda graph_name, timeout_ms: self._run(r, router, graph_name, query, timeout_ms),
+                target_graphs, concurrency=self.concurrency, timeout=self.timeout
+            )
+            return json.dumps({"status": "success", "multi_graph": True, "results": combined, "latency_ms": latency_ms})
+        except RedisConnectionError as e:
+            await manager.reset()
+            return json.dumps({"status": "error", "message": str(e)})
+        except Exception as e:
+            return json.dumps({"status": "error", "message": str(e)})
+
+
+def executor_from_env(get_mcp_pool, manager: FalkorClientManager = None) -> GraphExecutor:
+    """KLIM_GRAPH_BACKEND=direct (за замовчуванням) або mcp. manager — спільний пул FalkorDB процесу."""
+    mcp_executor = MCPGraphExecutor(get_mcp_pool)
+    backend = os.getenv("KLIM_GRAPH_BACKEND", "direct").lower()
+    if backend == "mcp":
+        return mcp_executor
+    if backend != "direct":
+        logger.warning(f"[graph_executor] Unknown KLIM_GRAPH_BACKEND={backend!r}, using direct")
+    return DirectGraphExecutor.from_env(fallback=mcp_executor, manager=manager)
@@ -0,0 +1,143 @@
+"""
+Спільний асинхронний HTTP-шар для викликів LLM-провайдерів (Gemini, OpenAI).
+
+Один httpx.AsyncClient на провайдера: keep-alive пул з'єднань (без нового
+TLS-handshake на кожен виклик), HTTP/2 якщо встановлено пакет h2,
+обмеження паралельності через семафор та тайм-аути з оточення.
+Базові URL теж беруться з оточення, тож замість API можна підставити
+локальний mock-сервер.
+"""
+import asyncio
+import logging
+import os
+
+import httpx
+
+logger = logging.getLogger("llm-provider-mcp")
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class ProviderConfig:
+    """Налаштування одного провайдера: GEMINI_BASE_URL, GEMINI_MAX_CONCURRENCY, GEMINI_TIMEOUT тощо."""
+
+    def __init__(self, name: str, base_url: str, max_concurrency: int = 8, timeout: float = 60.0,
+                 connect_timeout: float = 10.0, max_connections: int = 32, keepalive_expiry: float = 60.0):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_connections = max_connections
+        self.keepalive_expiry = keepalive_expiry
+
+    @classmethod
+    def from_env(cls, name: str, default_base_url: str, **overrides):
+        prefix = name.upper()
+
+        def env(key, default):
+            return os.getenv(f"{prefix}_{key}", os.getenv(f"LLM_HTTP_{key}", default))
+
+        settings = dict(
+            base_url=os.getenv(f"{prefix}_BASE_URL", default_base_url),
+            max_concurrency=int(env("MAX_CONCURRENCY", "8")),
+            timeout=float(env("TIMEOUT", "60")),
+            connect_timeout=float(env("CONNECT_TIMEOUT", "10")),
+            max_connections=int(env("MAX_CONNECTIONS", "32")),
+            keepalive_expiry=float(env("KEEPALIVE_EXPIRY", "60")),
+        )
+        settings.update(overrides)
+        return cls(name, **settings)
+
+
+class ProviderClient:
+    """Пул з'єднань та семафор одного провайдера. Прив'язаний до event loop, у якому створений."""
+
+    def __init__(self, config: ProviderConfig, http2: bool = True):
+        self.config = config
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self._semaphore = asyncio.Semaphore(config.max_concurrency)
+        self._client = httpx.AsyncClient(
+            base_url=config.base_url,
+            http2=self.http2,
+            timeout=httpx.Timeout(config.timeout, connect=config.connect_timeout),
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_connections,
+                keepalive_expiry=config.keepalive_expiry,
+            ),
+        )
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+
+    async def post_json(self, path: str, payload: dict, headers: dict = None, timeout: float = None) -> httpx.Response:
+        """POST з JSON-тілом. path — відносно base_url провайдера (або повний URL)."""
+        async with self._semaphore:
+            self.in_flight += 1
+            self.requests += 1
+            try:
+                return await self._client.post(
+                    path, json=payload, headers=headers,
+                    timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT
+                )
+            except httpx.HTTPError:
+                self.errors += 1
+                raise
+            finally:
+                self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "base_url": self.config.base_url,
+            "http2": self.http2,
+            "max_concurrency": self.config.max_concurrency,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+class LLMHttp:
+    """Реєстр провайдерів: llm_http.provider("gemini").post_json(...)."""
+
+    def __init__(self, configs: dict, http2: bool = True):
+        self.configs = configs
+        self.http2 = http2
+        self._clients = {}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            {
+                "gemini": ProviderConfig.from_env("gemini", "https://generativelanguage.googleapis.com/v1beta"),
+                "openai": ProviderConfig.from_env("openai", "https://api.openai.com/v1"),
+            },
+            http2=os.getenv("LLM_HTTP2", "1") == "1",
+        )
+
+    def provider(self, name: str) -> ProviderClient:
+        client = self._clients.get(name)
+        if client is None:
+            if name not in self.configs:
+                raise ValueError(f"Unknown LLM provider: {name}")
+            client = self._clients[name] = ProviderClient(self.configs[name], http2=self.http2)
+        return client
+
+    def stats(self) -> dict:
+        return {name: client.stats() for name, client in self._clients.items()}
+
+    async def aclose(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+
+llm_http = LLMHttp.from_env()
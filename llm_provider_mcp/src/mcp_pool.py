@@ -0,0 +1,210 @@
+"""
+Пул довгоживучих MCP-сесій до grynya-mcp-server.
+
+Замість sse_client + initialize() (та часто list_tools()) на кожен виклик
+пул тримає кілька вже ініціалізованих ClientSession. Кожна сесія живе у
+власній фоновій задачі (SSE-контекст має входити й виходити в одній задачі),
+періодично перевіряється ping-ом і перепідключається з backoff при обриві.
+MCP мультиплексує запити за id, тож одну сесію можуть одночасно
+використовувати кілька викликів — пул видає найменш завантажену.
+Список інструментів кешується на MCP_TOOLS_CACHE_TTL секунд.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+
+import anyio
+import httpx
+from mcp.client.session import ClientSession
+from mcp.client.sse import sse_client
+
+logger = logging.getLogger("llm-provider-mcp")
+
+# Помилки транспорту: сесія більше непридатна і має бути перепідключена
+TRANSPORT_ERRORS = (
+    anyio.ClosedResourceError,
+    anyio.BrokenResourceError,
+    anyio.EndOfStream,
+    httpx.HTTPError,
+    ConnectionError,
+)
+
+
+class _Slot:
+    """Одне SSE-з'єднання пулу та його фонова задача."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.session = None
+        self.borrowed = 0
+        self.task = None
+        self.stop = asyncio.Event()
+        self.connects = 0
+        self.last_error = None
+
+
+class MCPSessionPool:
+    def __init__(self, url: str, size: int = 2, headers: dict = None, connect_timeout: float = 10.0,
+                 ping_interval: float = 30.0, ping_timeout: float = 5.0, acquire_timeout: float = 30.0,
+                 tools_ttl: float = 300.0, backoff_base: float = 0.5, backoff_cap: float = 30.0):
+        self.url = url
+        self.size = max(1, size)
+        self.headers = headers if headers is not None else {"Host": "localhost"}
+        self.connect_timeout = connect_timeout
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.acquire_timeout = acquire_timeout
+        self.tools_ttl = tools_ttl
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+        self._slots = []
+        self._changed = asyncio.Event()
+        self._health_task = None
+        self._closing = False
+        self._tools = None
+        self._tools_expires = 0.0
+        self._tools_lock = asyncio.Lock()
+        self.recycled = 0
+
+    @classmethod
+    def from_env(cls, **overrides):
+        """MCP_SERVER_URL, MCP_POOL_SIZE, MCP_POOL_PING_INTERVAL, MCP_POOL_ACQUIRE_TIMEOUT, MCP_TOOLS_CACHE_TTL."""
+        settings = dict(
+            url=os.getenv("MCP_SERVER_URL", "http://grynya-mcp-server:8000/sse"),
+            size=int(os.getenv("MCP_POOL_SIZE", "2")),
+            connect_timeout=float(os.getenv("MCP_POOL_CONNECT_TIMEOUT", "10")),
+            ping_interval=float(os.getenv("MCP_POOL_PING_INTERVAL", "30")),
+            acquire_timeout=float(os.getenv("MCP_POOL_ACQUIRE_TIMEOUT", "30")),
+            tools_ttl=float(os.getenv("MCP_TOOLS_CACHE_TTL", "300")),
+        )
+        settings.update(overrides)
+        return cls(**settings)
+
+    def _ensure_started(self):
+        if self._slots or self._closing:
+            return
+        self._slots = [_Slot(i) for i in range(self.size)]
+        for slot in self._slots:
+            slot.task = asyncio.create_task(self._run_slot(slot))
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    async def _run_slot(self, slot: _Slot):
+        delay = self.backoff_base
+        while not self._closing:
+            slot.stop.clear()
+            try:
+                async with sse_client(self.url, headers=self.headers, timeout=self.connect_timeout) as streams:
+                    async with ClientSession(streams[0], streams[1]) as session:
+                        await asyncio.wait_for(session.initialize(), timeout=self.connect_timeout)
+                        slot.session = session
+                        slot.connects += 1
+                        slot.last_error = None
+                        delay = self.backoff_base
+                        self._changed.set()
+                        logger.info(f"[mcp_pool] Session {slot.index} connected to {self.url}")
+                        await slot.stop.wait()
+            except asyncio.CancelledError:
+                raise
+            except BaseException as e:
+                slot.last_error = str(e)
+                logger.warning(f"[mcp_pool] Session {slot.index} failed: {e}")
+            finally:
+                slot.session = None
+            if self._closing:
+                break
+            await asyncio.sleep(min(self.backoff_cap, delay) * (0.5 + random.random() / 2))
+            delay *= 2
+
+    def _recycle(self, slot: _Slot, reason: str):
+        if slot.session is None:
+            return
+        logger.warning(f"[mcp_pool] Recycling session {slot.index}: {reason}")
+        slot.session = None
+        slot.last_error = reason
+        slot.stop.set()
+        self.recycled += 1
+        self._tools = None
+
+    async def _health_loop(self):
+        while not self._closing:
+            await asyncio.sleep(self.ping_interval)
+            for slot in self._slots:
+                session = slot.session
+                if session is None:
+                    continue
+                try:
+                    await asyncio.wait_for(session.send_ping(), timeout=self.ping_timeout)
+                except Exception as e:
+                    self._recycle(slot, f"ping failed: {e!r}")
+
+    async def _pick(self) -> _Slot:
+        self._ensure_started()
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            ready = [slot for slot in self._slots if slot.session is not None]
+            if ready:
+                return min(ready, key=lambda slot: slot.borrowed)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                errors = "; ".join(s.last_error for s in self._slots if s.last_error)
+                raise TimeoutError(f"No MCP session to {self.url} available after {self.acquire_timeout}s: {errors}")
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    @asynccontextmanager
+    async def session(self):
+        """Позичає ініціалізовану ClientSession. Помилка транспорту перепідключає її."""
+        slot = await self._pick()
+        session = slot.session
+        slot.borrowed += 1
+        try:
+            yield session
+        except TRANSPORT_ERRORS as e:
+            if slot.session is session:
+                self._recycle(slot, repr(e))
+            raise
+        finally:
+            slot.borrowed -= 1
+
+    async def list_tools(self, refresh: bool = False):
+        """Кешований результат list_tools()."""
+        if not refresh and self._tools is not None and time.monotonic() < self._tools_expires:
+            return self._tools
+        async with self._tools_lock:
+            if refresh or self._tools is None or time.monotonic() >= self._tools_expires:
+                async with self.session() as session:
+                    self._tools = await session.list_tools()
+                self._tools_expires = time.monotonic() + self.tools_ttl
+            return self._tools
+
+    async def call_tool(self, name: str, arguments: dict = None):
+        async with self.session() as session:
+            return await session.call_tool(name, arguments=arguments)
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "size": self.size,
+            "ready": sum(1 for slot in self._slots if slot.session is not None),
+            "borrowed": sum(slot.borrowed for slot in self._slots),
+            "connects": sum(slot.connects for slot in self._slots),
+            "recycled": self.recycled,
+            "tools_cached": self._tools is not None,
+        }
+
+    async def close(self):
+        self._closing = True
+        if self._health_task:
+            self._health_task.cancel()
+        for slot in self._slots:
+            slot.session = None
+            slot.stop.set()
+        await asyncio.gather(*(slot.task for slot in self._slots if slot.task), return_exceptions=True)
+        self._slots = []
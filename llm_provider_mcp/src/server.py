@@ -2,10 +2,9 @@ import os
 import sys
 import asyncio
 import json
-import threading
+import socket
 import logging
 from contextvars import ContextVar
-from dataclasses import dataclass, field
 from io import StringIO
 from dotenv import load_dotenv
 
@@ -23,34 +22,48 @@ logger = logging.getLogger("llm-provider-mcp")
 
 load_dotenv()
 
+# Спільні модулі FalkorDB MCP сервера (db_client, task_stream тощо) образ копіює
+# в /opt/falkordb_mcp і додає до PYTHONPATH; поза Docker — PYTHONPATH=falkordb-service/mcp.
+
 # --- Task Manager Infrastructure (Phase 1) ---
 
 current_task_id = ContextVar("current_task_id", default=None)
 
-@dataclass
-class TaskState:
-    id: str
-    status: str  # "running", "completed", "failed", "cancelled"
-    logs_buffer: list = field(default_factory=list)
-    result: str = None
-    error: str = None
-    task_obj: asyncio.Task = None
+from db_client import FalkorClientManager
+from task_store import TaskStore
 
-TaskManager: dict[str, TaskState] = {}
-log_lock = threading.Lock()
+# One FalkorDB/Redis pool per process: task store, Klim stream listener and the direct graph backend
+falkor_manager = FalkorClientManager.from_env()
 
-class AsyncIOSafeLogHandler(logging.Handler):
-    def emit(self, record):
+# Bounded task store (TTL + LRU for finished tasks, capped logs); optional file/redis persistence
+TaskManager = TaskStore.from_env(get_redis=falkor_manager.get)
+
+class TaskLogHandler(logging.Handler):
+    """
+    Кладе LogRecord у буфер задачі з current_task_id. Без форматування рядка (воно
+    відкладене до читання логів) і без lock обробника: у кожної задачі свій deque.
+    """
+    def handle(self, record):
         task_id = current_task_id.get()
-        if task_id and task_id in TaskManager:
-            msg = self.format(record)
-            with log_lock:
-                TaskManager[task_id].logs_buffer.append(msg + "\n")
+        if task_id is None:
+            return False
+        state = TaskManager.peek(task_id)
+        if state is None or not self.filter(record):
+            return False
+        state.append_log(record)
+        return True
+
+    def emit(self, record):
+        self.handle(record)
 
-# Add the task-aware handler to our logger
-task_handler = AsyncIOSafeLogHandler()
+# Add the task-aware handler to our logger (TASK_LOG_LEVEL filters what lands in task logs)
+task_handler = TaskLogHandler(level=os.getenv("TASK_LOG_LEVEL", "INFO").upper())
 logger.addHandler(task_handler)
 
+# Per-iteration lines of the agentic loop are DEBUG: below AGENTIC_LOOP_LOG_LEVEL they cost a level check only
+loop_logger = logging.getLogger("llm-provider-mcp.agentic_loop")
+loop_logger.setLevel(os.getenv("AGENTIC_LOOP_LOG_LEVEL", "INFO").upper())
+
 # Redirect print to logger.info to ensure it goes to stderr and gets captured
 def safe_print(*args, **kwargs):
     msg = " ".join(map(str, args))
@@ -59,30 +72,86 @@ def safe_print(*args, **kwargs):
 # Monkeypatch print for this module
 print = safe_print
 
-from fastmcp import FastMCP
+from contextlib import asynccontextmanager
+from fastmcp import Context, FastMCP
+from llm_http import llm_http
+from mcp_pool import MCPSessionPool
+from graph_executor import GraphExecutor, executor_from_env
+from context_budget import ContextBudget
+from credentials import GeminiCredentials
+from task_dispatcher import TaskDispatcher
+from task_stream import TaskStreamConsumer, deliver_result
+
+# How long shutdown waits for in-flight Klim and agent tasks before cancelling them (seconds)
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "10"))
+
+@asynccontextmanager
+async def server_lifespan(server):
+    """
+    Усе працює в одному event loop сервера: слухач klim:tasks — фонова задача,
+    пули (Redis, HTTP, MCP) спільні для інструментів та воркерів Klim.
+    При зупинці: припиняємо читати потік, даємо задачам доопрацювати
+    SHUTDOWN_DRAIN_TIMEOUT секунд, решту скасовуємо та закриваємо пули.
+    Непідтверджені задачі потоку заберуть інші воркери (XAUTOCLAIM) або цей після рестарту.
+    """
+    global task_dispatcher, task_consumer
+    # Ім'я споживача стабільне між перезапусками контейнера: після рестарту
+    # воркер спершу дочитує свої непідтверджені задачі
+    task_consumer = TaskStreamConsumer.from_env(os.getenv("KLIM_CONSUMER_NAME", socket.gethostname()))
+    task_dispatcher = TaskDispatcher(
+        lambda payload: handle_research_task(falkor_manager, payload),
+        workers=int(os.getenv("KLIM_WORKERS", "4")),
+        max_queue=int(os.getenv("KLIM_QUEUE_SIZE", "100")),
+        default_ttl=float(os.getenv("KLIM_TASK_TTL", "45"))
+    )
+    task_dispatcher.start()
+    listener = asyncio.create_task(background_listener(falkor_manager, task_consumer, task_dispatcher))
+    print("[lifespan] Klim listener started")
+    try:
+        yield
+    finally:
+        print("[lifespan] Shutting down: draining in-flight tasks...")
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+        if not await task_dispatcher.drain(SHUTDOWN_DRAIN_TIMEOUT):
+            print("[lifespan] Klim tasks still running after drain timeout were cancelled")
+        
+        agent_tasks = [state.task_obj for state in TaskManager.running() if state.task_obj and not state.task_obj.done()]
+        if agent_tasks:
+            _, pending = await asyncio.wait(agent_tasks, timeout=SHUTDOWN_DRAIN_TIMEOUT)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        
+        await gemini_credentials.stop()
+        await graph_executor.close()
+        await mcp_pool.close()
+        await llm_http.aclose()
+        await falkor_manager.close()
+        print("[lifespan] Shutdown complete")
+
 # Create the MCP server
-mcp = FastMCP("llm-provider-mcp")
+mcp = FastMCP("llm-provider-mcp", lifespan=server_lifespan)
 
-def call_gemini(prompt: str, system_prompt: str, model: str, tools_info: str = None) -> str:
-    from google import genai
-    from google.genai import types
-    from google.oauth2.credentials import Credentials
-    import os
-    
+# Long-lived sessions to grynya-mcp-server, shared by tools and Klim workers
+mcp_pool = MCPSessionPool.from_env()
+
+def get_mcp_pool() -> MCPSessionPool:
+    return mcp_pool
+
+# Cypher backend for the Klim agentic loop (KLIM_GRAPH_BACKEND=direct|mcp)
+graph_executor = executor_from_env(get_mcp_pool, falkor_manager)
+
+# Gemini OAuth token: cached in memory, refreshed in the background before expiry
+gemini_credentials = GeminiCredentials.from_env()
+
+async def call_gemini(prompt: str, system_prompt: str, model: str, tools_info: str = None) -> str:
     print("[call_gemini] Entering Gemini API wrapper")
-    token_path = os.environ.get("GEMINI_TOKEN_PATH", "credentials/token.json")
-    
-    if not os.path.exists(token_path):
-        return f"Error: Token file not found at {token_path}. Please generate it via OAuth and place it in the credentials folder."
+    if not gemini_credentials.available():
+        return f"Error: Token file not found at {gemini_credentials.token_path}. Please generate it via OAuth and place it in the credentials folder."
         
     try:
-        from google.auth.transport.requests import Request
-        import requests
-        
-        creds = Credentials.from_authorized_user_file(token_path)
-        if not creds.valid:
-            if creds.expired and creds.refresh_token:
-                creds.refresh(Request())
+        creds = await gemini_credentials.get()
             
         if not model.startswith("models/"):
             full_model_name = f"models/{model}"
@@ -91,7 +160,6 @@ def call_gemini(prompt: str, system_prompt: str, model: str, tools_info: str = N
 
         print(f"[call_gemini] Using direct REST API request with Bearer token.")
         
-        url = f"https://generativelanguage.googleapis.com/v1beta/{full_model_name}:generateContent"
         headers = {
             "Authorization": f"Bearer {creds.token}",
             "Content-Type": "application/json"
@@ -113,7 +181,7 @@ def call_gemini(prompt: str, system_prompt: str, model: str, tools_info: str = N
         }]
             
         print(f"[call_gemini] Sending request to Gemini {model}... This might take a while.")
-        response = requests.post(url, headers=headers, json=payload)
+        response = await llm_http.provider("gemini").post_json(f"{full_model_name}:generateContent", payload, headers=headers)
         
         if response.status_code != 200:
             return f"Error: Gemini API returned status {response.status_code}: {response.text}"
@@ -133,15 +201,12 @@ def call_gemini(prompt: str, system_prompt: str, model: str, tools_info: str = N
         traceback.print_exc()
         return f"Gemini API Error: {str(e)}"
 
-def call_openai(prompt: str, system_prompt: str, model: str) -> str:
-    from openai import OpenAI
-    
+async def call_openai(prompt: str, system_prompt: str, model: str) -> str:
     print("[call_openai] Entering OpenAI API wrapper")
     api_key = os.environ.get("OPENAI_API_KEY")
     if not api_key:
         return "Error: OPENAI_API_KEY not configured."
         
-    client = OpenAI(api_key=api_key)
     messages = []
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
@@ -149,12 +214,14 @@ def call_openai(prompt: str, system_prompt: str, model: str) -> str:
     
     try:
         print(f"[call_openai] Sending request to OpenAI {model}... This might take a while.")
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages
+        response = await llm_http.provider("openai").post_json(
+            "chat/completions",
+            {"model": model, "messages": messages},
+            headers={"Authorization": f"Bearer {api_key}"}
         )
+        response.raise_for_status()
         print("[call_openai] Received response from OpenAI API.")
-        return response.choices[0].message.content
+        return response.json()["choices"][0]["message"]["content"]
     except Exception as e:
         print(f"[call_openai] Encountered an error: {str(e)}")
         import traceback
@@ -190,44 +257,38 @@ def load_skill(skill_name: str) -> str:
             "\"graphs_searched\": [], \"queries_executed\": [], \"is_empty\": true/false}"
         )
 
-def _get_gemini_credentials():
-    from google.oauth2.credentials import Credentials
-    from google.auth.transport.requests import Request
-    token_path = os.environ.get("GEMINI_TOKEN_PATH", "credentials/token.json")
-    if not os.path.exists(token_path):
-        raise FileNotFoundError(f"Token file not found at {token_path}")
-    creds = Credentials.from_authorized_user_file(token_path)
-    if not creds.valid and creds.expired and creds.refresh_token:
-        creds.refresh(Request())
-    return creds
-
-def _gemini_api_call(url: str, headers: dict, payload: dict) -> dict:
-    """Синхронний HTTP виклик до Gemini API — запускається через asyncio.to_thread."""
-    import requests as http_requests
-    response = http_requests.post(url, headers=headers, json=payload, timeout=60)
+async def _gemini_api_call(path: str, headers: dict, payload: dict) -> dict:
+    """HTTP виклик до Gemini API через спільний пул з'єднань (path відносно GEMINI_BASE_URL)."""
+    response = await llm_http.provider("gemini").post_json(path, payload, headers=headers)
     response.raise_for_status()
     return response.json()
 
 
+# Function calls of a single Gemini turn: concurrency limit and per-call timeout (seconds)
+AGENT_TOOL_CONCURRENCY = int(os.getenv("AGENT_TOOL_CONCURRENCY", "4"))
+AGENT_TOOL_TIMEOUT = float(os.getenv("AGENT_TOOL_TIMEOUT", "30"))
+# Per-result caps and compaction threshold for the contents resent to Gemini every iteration
+context_budget = ContextBudget.from_env()
+
+
 async def call_gemini_agentic_loop(
     prompt: str,
     system_prompt: str,
     model: str,
-    falkordb_session,
+    executor: GraphExecutor,
     max_iterations: int = 10
 ) -> tuple[str, list[str], list[str]]:
     """
     Запускає Gemini у агентному циклі з Function Calling для query_graph.
-    HTTP-виклики до Gemini виконуються через asyncio.to_thread (не блокують event loop).
+    HTTP-виклики до Gemini йдуть через асинхронний пул з'єднань llm_http,
+    а Cypher-запити моделі виконує executor (напряму в FalkorDB або через MCP).
+    Кілька functionCall одного ходу виконуються паралельно (AGENT_TOOL_CONCURRENCY).
     Повертає: (final_text, queries_executed, graphs_searched)
     """
-    creds = await asyncio.to_thread(_get_gemini_credentials)
-
     if not model.startswith("models/"):
         model = f"models/{model}"
 
-    url = f"https://generativelanguage.googleapis.com/v1beta/{model}:generateContent"
-    headers = {"Authorization": f"Bearer {creds.token}", "Content-Type": "application/json"}
+    path = f"{model}:generateContent"
 
     tools_declaration = [{
         "functionDeclarations": [{
@@ -252,27 +313,33 @@ async def call_gemini_agentic_loop(
     }]
 
     contents = [{"role": "user", "parts": [{"text": prompt}]}]
+    call_semaphore = asyncio.Semaphore(AGENT_TOOL_CONCURRENCY)
     queries_executed = []
     graphs_searched = set()
     final_text = ""
 
     for iteration in range(max_iterations):
+        compacted = context_budget.compact(contents)
+        if compacted:
+            loop_logger.debug("[agentic_loop] Compacted %d older tool results to fit the context budget", compacted)
         payload = {"contents": contents, "tools": tools_declaration}
         if system_prompt:
             payload["systemInstruction"] = {"parts": [{"text": system_prompt}]}
 
-        print(f"[agentic_loop] Iteration {iteration + 1}/{max_iterations}")
+        loop_logger.debug("[agentic_loop] Iteration %d/%d", iteration + 1, max_iterations)
+        # Токен береться з кешу на кожній ітерації: довгий цикл не переживе його термін дії
+        headers = {"Authorization": f"Bearer {await gemini_credentials.token()}", "Content-Type": "application/json"}
         try:
-            data = await asyncio.to_thread(_gemini_api_call, url, headers, payload)
+            data = await _gemini_api_call(path, headers, payload)
         except Exception as api_err:
-            print(f"[agentic_loop] Gemini API call failed: {api_err}")
+            loop_logger.warning("[agentic_loop] Gemini API call failed: %s", api_err)
             raise
 
         candidates = data.get("candidates", [])
         if not candidates:
             prompt_feedback = data.get("promptFeedback", {})
             block_reason = prompt_feedback.get("blockReason", "UNKNOWN")
-            print(f"[agentic_loop] Empty candidates! blockReason={block_reason}, raw={json.dumps(data)[:300]}")
+            loop_logger.warning("[agentic_loop] Empty candidates! blockReason=%s, raw=%.300s", block_reason, json.dumps(data))
             break
 
         candidate = candidates[0]
@@ -280,46 +347,48 @@ async def call_gemini_agentic_loop(
         parts = content.get("parts", [])
         finish_reason = candidate.get("finishReason", "STOP")
 
-        print(f"[agentic_loop] finishReason={finish_reason}, parts_count={len(parts)}")
+        loop_logger.debug("[agentic_loop] finishReason=%s, parts_count=%d", finish_reason, len(parts))
 
         function_calls = [p["functionCall"] for p in parts if "functionCall" in p]
 
         if not function_calls:
             final_text = "".join(p.get("text", "") for p in parts)
-            print(f"[agentic_loop] Final text response ({len(final_text)} chars)")
+            loop_logger.info("[agentic_loop] Final text response (%d chars)", len(final_text))
             break
 
         contents.append({"role": "model", "parts": parts})
 
-        function_responses = []
-        for fc in function_calls:
+        async def execute_call(fc):
             fc_name = fc["name"]
             fc_args = fc.get("args", {})
             cypher = fc_args.get("query", "")
             fc_graphs = fc_args.get("graphs", None)
 
-            queries_executed.append(cypher)
-            if fc_graphs:
-                graphs_searched.update(fc_graphs)
-
-            print(f"[agentic_loop] Executing {fc_name}: {cypher[:80]}...")
-            try:
-                result = await falkordb_session.call_tool(
-                    "query_graph",
-                    arguments={"query": cypher, "graphs": fc_graphs} if fc_graphs else {"query": cypher}
-                )
-                result_text = result.content[0].text if result.content else "{}"
-            except Exception as e:
-                result_text = json.dumps({"status": "error", "message": str(e)})
+            async with call_semaphore:
+                loop_logger.debug("[agentic_loop] Executing %s: %.80s...", fc_name, cypher)
+                try:
+                    result_text = await asyncio.wait_for(executor.query(cypher, fc_graphs), timeout=AGENT_TOOL_TIMEOUT)
+                except asyncio.TimeoutError:
+                    result_text = json.dumps({"status": "error", "message": f"Timeout after {AGENT_TOOL_TIMEOUT}s"})
+                except Exception as e:
+                    result_text = json.dumps({"status": "error", "message": str(e)})
 
-            function_responses.append({
+            return {
                 "functionResponse": {
                     "name": fc_name,
-                    "response": {"result": result_text}
+                    "response": {"result": context_budget.fit_result(result_text)}
                 }
-            })
+            }
+
+        for fc in function_calls:
+            fc_args = fc.get("args", {})
+            queries_executed.append(fc_args.get("query", ""))
+            if fc_args.get("graphs"):
+                graphs_searched.update(fc_args["graphs"])
 
-        contents.append({"role": "user", "parts": function_responses})
+        # Виклики одного ходу виконуються паралельно; gather зберігає порядок відповідей
+        function_responses = await asyncio.gather(*(execute_call(fc) for fc in function_calls))
+        contents.append({"role": "user", "parts": list(function_responses)})
     else:
         final_text = f"Досягнуто ліміт ітерацій ({max_iterations}). Останні результати збережено."
 
@@ -327,107 +396,94 @@ async def call_gemini_agentic_loop(
 
 
 async def agent_task_wrapper(task_id: str, prompt: str, system_prompt: str, model: str):
-    """Background wrapper that executes the LLM task via a thread and manages state."""
-    from mcp.client.sse import sse_client
-    from mcp.client.session import ClientSession
-    
+    """Background wrapper that executes the LLM task and manages state."""
     current_task_id.set(task_id)
     state = TaskManager[task_id]
     try:
         print(f"--- [Task {task_id}] Execution Started ---")
         
-        server_url = "http://grynya-mcp-server:8000/sse"
-        print(f"[{task_id}] Connecting to MCP server at {server_url}...")
+        mcp_pool = get_mcp_pool()
+        print(f"[{task_id}] Borrowing MCP session to {mcp_pool.url}...")
         
-        async with sse_client(server_url, headers={"Host": "localhost"}) as streams:
-            print(f"[{task_id}] SSE connection established.")
-            async with ClientSession(streams[0], streams[1]) as session:
-                await session.initialize()
-                print(f"[{task_id}] MCP Session initialized.")
-                
-                tools_response = await session.list_tools()
-                tool_names = [t.name for t in tools_response.tools]
-                print(f"[{task_id}] Discovered tools: {tool_names}")
-                print(f"[{task_id}] Бачу базу та інструменти, полет нормальний.")
-
-                # Direct write to the graph (Phase 3)
-                import datetime
-                now = datetime.datetime.now(datetime.timezone.utc)
-                day_id_str = "d_" + now.strftime("%Y_%m_%d")
-                
-                print(f"[{task_id}] Writing progress to FalkorDB directly via grynya-mcp-server...")
-                try:
-                    save_res = await session.call_tool("add_node", arguments={
-                        "node_type": "Analysis",
-                        "node_data": {
-                            "id": f"klim_progress_{task_id}",
-                            "full_text": f"[Status Update from Klim] Task ID: {task_id}. Proceeding with model {model}.",
-                            "time": now.isoformat()
-                        },
-                        "day_id": day_id_str
-                    })
-                    print(f"[{task_id}] Graph save response: {save_res}")
-                except Exception as e:
-                    print(f"[{task_id}] Failed to save to graph: {e}")
+        async with mcp_pool.session() as session:
+            print(f"[{task_id}] MCP Session ready.")
+            
+            tools_response = await mcp_pool.list_tools()
+            tool_names = [t.name for t in tools_response.tools]
+            print(f"[{task_id}] Discovered tools: {tool_names}")
+            print(f"[{task_id}] Бачу базу та інструменти, полет нормальний.")
+
+            # Direct write to the graph (Phase 3)
+            import datetime
+            now = datetime.datetime.now(datetime.timezone.utc)
+            day_id_str = "d_" + now.strftime("%Y_%m_%d")
+            
+            print(f"[{task_id}] Writing progress to FalkorDB directly via grynya-mcp-server...")
+            try:
+                save_res = await session.call_tool("add_node", arguments={
+                    "node_type": "Analysis",
+                    "node_data": {
+                        "id": f"klim_progress_{task_id}",
+                        "full_text": f"[Status Update from Klim] Task ID: {task_id}. Proceeding with model {model}.",
+                        "time": now.isoformat()
+                    },
+                    "day_id": day_id_str
+                })
+                print(f"[{task_id}] Graph save response: {save_res}")
+            except Exception as e:
+                print(f"[{task_id}] Failed to save to graph: {e}")
 
         
-        # Execute blocking calls off the main event loop
+        # Provider calls go through the shared async HTTP pool (llm_http)
         model_lower = model.lower()
         if "gemini" in model_lower:
-            result = await asyncio.to_thread(call_gemini, prompt, system_prompt, model)
+            result = await call_gemini(prompt, system_prompt, model)
         elif "gpt" in model_lower or "o1" in model_lower or "o3" in model_lower:
-            result = await asyncio.to_thread(call_openai, prompt, system_prompt, model)
+            result = await call_openai(prompt, system_prompt, model)
         else:
             result = f"Error: Unsupported model identifier '{model}'. Must contain 'gemini', 'gpt', 'o1' or 'o3'."
             
-        state.result = f"{result}\n\n[Автономний агент рапортує: Бачу базу та інструменти, полет нормальний.]"
-        state.status = "completed"
         print(f"--- [Task {task_id}] Execution Completed ---")
+        await TaskManager.finish(
+            state, "completed",
+            result=f"{result}\n\n[Автономний агент рапортує: Бачу базу та інструменти, полет нормальний.]"
+        )
     except asyncio.CancelledError:
         print(f"--- [Task {task_id}] Execution Cancelled ---")
-        state.status = "cancelled"
-        state.error = "Cancelled by user"
+        await TaskManager.finish(state, "cancelled", error="Cancelled by user")
     except Exception as e:
         import traceback
         error_msg = traceback.format_exc()
         print(f"--- [Task {task_id}] Execution Failed ---")
         print(error_msg)
-        state.status = "failed"
-        state.error = str(e)
+        await TaskManager.finish(state, "failed", error=str(e))
 
 @mcp.tool()
 async def run_agent_task(prompt: str, system_prompt: str = None, model: str = "gemini-2.5-flash") -> str:
     """
     [БЛОКУЄ] Запускає задачу агента синхронно через вказаного LLM провайдера.
-    Примітка: Блокує event loop сервера FastMCP при інтенсивному використанні.
+    Відповідь повертається лише після завершення виклику моделі.
     """
     print(f"[run_agent_task] Received request for model: {model}")
     
     # Discovery tools from grynya-mcp-server
     tools_info = "No database tools discovered."
-    from mcp.client.sse import sse_client
-    from mcp.client.session import ClientSession
-    
-    server_url = "http://grynya-mcp-server:8000/sse"
     try:
-        async with sse_client(server_url, headers={"Host": "localhost"}) as streams:
-            async with ClientSession(streams[0], streams[1]) as session:
-                await session.initialize()
-                tools_response = await session.list_tools()
-                tools_list = []
-                for t in tools_response.tools:
-                    tools_list.append(f"Tool: {t.name}, Description: {t.description}")
-                tools_info = "\n".join(tools_list)
-                print(f"[run_agent_task] Discovered {len(tools_response.tools)} database tools.")
+        tools_response = await get_mcp_pool().list_tools()
+        tools_list = []
+        for t in tools_response.tools:
+            tools_list.append(f"Tool: {t.name}, Description: {t.description}")
+        tools_info = "\n".join(tools_list)
+        print(f"[run_agent_task] Discovered {len(tools_response.tools)} database tools.")
     except Exception as e:
         print(f"[run_agent_task] Failed to discover tools: {e}")
 
     model_lower = model.lower()
     if "gemini" in model_lower:
-        return await asyncio.to_thread(call_gemini, prompt, system_prompt, model, tools_info)
+        return await call_gemini(prompt, system_prompt, model, tools_info)
     elif "gpt" in model_lower or "o1" in model_lower or "o3" in model_lower:
         # OpenAI doesn't get tools metadata yet in this simple wrapper
-        return await asyncio.to_thread(call_openai, prompt, system_prompt, model)
+        return await call_openai(prompt, system_prompt, model)
     else:
         return f"Error: Unsupported model identifier '{model}'."
 
@@ -440,8 +496,8 @@ async def start_async_agent_task(prompt: str, system_prompt: str = None, model:
     """
     import uuid
     task_id = str(uuid.uuid4())
-    state = TaskState(id=task_id, status="running")
-    TaskManager[task_id] = state
+    state = TaskManager.create(task_id)
+    await TaskManager.persist(state)
     
     # create background task without blocking
     task_obj = asyncio.create_task(agent_task_wrapper(task_id, prompt, system_prompt, model))
@@ -458,10 +514,9 @@ def cancel_agent_task(task_id: str) -> str:
     """
     Скасовує асинхронну задачу агента, яка виконується у фоновому режимі.
     """
-    if task_id not in TaskManager:
-        return json.dumps({"status": "error", "message": f"Task {task_id} not found."})
-        
-    state = TaskManager[task_id]
+    state = TaskManager.peek(task_id)
+    if state is None:
+        return json.dumps({"status": "error", "message": f"Task {task_id} not found on this replica."})
     
     if state.status == "running":
         if state.task_obj and not state.task_obj.done():
@@ -490,108 +545,102 @@ async def research_graph(
     model: модель Gemini для використання (default: gemini-2.5-flash)
     skill_name: назва скілу в .gemini/antigravity/skills/<skill_name>/SKILL.md (default: graph-research)
     """
-    from mcp.client.sse import sse_client
-    from mcp.client.session import ClientSession
     import datetime
 
-    server_url = "http://grynya-mcp-server:8000/sse"
     print(f"[research_graph] Starting research for query: {user_query[:80]}...")
     print(f"[research_graph] Target graphs: {graphs}, skill: {skill_name}")
 
     skill_prompt = load_skill(skill_name)
 
     try:
-        async with sse_client(server_url, headers={"Host": "localhost"}) as streams:
-            async with ClientSession(streams[0], streams[1]) as session:
-                await session.initialize()
-                print("[research_graph] FalkorDB session initialized.")
-
-                graphs_to_search = graphs if graphs else ["Grynya"]
-                search_prompt = (
-                    f"Search graphs {graphs_to_search} for information relevant to this query:\n"
-                    f"«{user_query}»\n\n"
-                    f"Follow the instructions in your system prompt. Return valid JSON."
-                )
-
-                final_text, queries_executed, graphs_searched = await call_gemini_agentic_loop(
-                    prompt=search_prompt,
-                    system_prompt=skill_prompt,
-                    model=model,
-                    falkordb_session=session
-                )
-
-                if not graphs_searched:
-                    graphs_searched = graphs_to_search
-
-                now = datetime.datetime.now(datetime.timezone.utc)
-                research_id = f"research_{now.strftime('%Y%m%d_%H%M%S')}"
-                day_id = f"d_{now.strftime('%Y_%m_%d')}"
-
-                def _strip_markdown_json(text: str) -> str:
-                    """Видаляє ```json ... ``` або ``` ... ``` обгортку якщо є."""
-                    text = text.strip()
-                    if text.startswith("```"):
-                        lines = text.split("\n")
-                        # Відкидаємо перший рядок (```json або ```) і останній (```)
-                        inner = lines[1:] if lines[-1].strip() == "```" else lines[1:]
-                        if inner and inner[-1].strip() == "```":
-                            inner = inner[:-1]
-                        text = "\n".join(inner).strip()
-                    return text
-
-                clean_text = _strip_markdown_json(final_text) if final_text else ""
-                try:
-                    report_data = json.loads(clean_text)
-                    summary = report_data.get("summary", clean_text[:300])
-                    found_nodes = report_data.get("found_nodes", [])
-                    source_node_ids = [n["id"] for n in found_nodes if "id" in n]
-                    is_empty = report_data.get("is_empty", not bool(found_nodes))
-                except (json.JSONDecodeError, TypeError):
-                    summary = clean_text[:500] if clean_text else "Дослідження завершено, результати відсутні."
-                    source_node_ids = []
-                    is_empty = not bool(clean_text)
-
-                node_data = {
-                    "id": research_id,
-                    "name": f"Research: {user_query[:60]}",
-                    "query": user_query,
-                    "summary": summary,
-                    "full_report": final_text[:4000] if final_text else "",
-                    "cypher_queries": json.dumps(queries_executed),
-                    "graphs_searched": json.dumps(graphs_searched),
-                    "source_node_ids": json.dumps(source_node_ids),
-                    "is_empty": is_empty,
-                    "time": now.isoformat()
-                }
+        graphs_to_search = graphs if graphs else ["Grynya"]
+        search_prompt = (
+            f"Search graphs {graphs_to_search} for information relevant to this query:\n"
+            f"«{user_query}»\n\n"
+            f"Follow the instructions in your system prompt. Return valid JSON."
+        )
 
-                if save_to_graph:
-                    save_result = await session.call_tool("add_node", arguments={
-                        "node_type": "Research",
-                        "node_data": node_data,
-                        "day_id": day_id,
-                        "time": now.strftime("%H:%M:%S")
-                    })
-                    print(f"[research_graph] :Research node saved: {research_id}")
-
-                    if source_node_ids:
-                        links = [
-                            {"source_id": research_id, "target_id": nid, "type": "SOURCED_FROM"}
-                            for nid in source_node_ids[:20]
-                        ]
-                        await session.call_tool("batch_link_nodes", arguments={"links": links})
-                        print(f"[research_graph] Linked {len(links)} source nodes.")
-                else:
-                    print(f"[research_graph] Skipping DB modifications: save_to_graph=False")
-
-                return json.dumps({
-                    "status": "success",
-                    "research_node_id": research_id,
-                    "summary": summary,
-                    "graphs_searched": graphs_searched,
-                    "queries_executed_count": len(queries_executed),
-                    "source_nodes_found": len(source_node_ids),
-                    "is_empty": is_empty
+        final_text, queries_executed, graphs_searched = await call_gemini_agentic_loop(
+            prompt=search_prompt,
+            system_prompt=skill_prompt,
+            model=model,
+            executor=graph_executor
+        )
+
+        if not graphs_searched:
+            graphs_searched = graphs_to_search
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        research_id = f"research_{now.strftime('%Y%m%d_%H%M%S')}"
+        day_id = f"d_{now.strftime('%Y_%m_%d')}"
+
+        def _strip_markdown_json(text: str) -> str:
+            """Видаляє ```json ... ``` або ``` ... ``` обгортку якщо є."""
+            text = text.strip()
+            if text.startswith("```"):
+                lines = text.split("\n")
+                # Відкидаємо перший рядок (```json або ```) і останній (```)
+                inner = lines[1:] if lines[-1].strip() == "```" else lines[1:]
+                if inner and inner[-1].strip() == "```":
+                    inner = inner[:-1]
+                text = "\n".join(inner).strip()
+            return text
+
+        clean_text = _strip_markdown_json(final_text) if final_text else ""
+        try:
+            report_data = json.loads(clean_text)
+            summary = report_data.get("summary", clean_text[:300])
+            found_nodes = report_data.get("found_nodes", [])
+            source_node_ids = [n["id"] for n in found_nodes if "id" in n]
+            is_empty = report_data.get("is_empty", not bool(found_nodes))
+        except (json.JSONDecodeError, TypeError):
+            summary = clean_text[:500] if clean_text else "Дослідження завершено, результати відсутні."
+            source_node_ids = []
+            is_empty = not bool(clean_text)
+
+        node_data = {
+            "id": research_id,
+            "name": f"Research: {user_query[:60]}",
+            "query": user_query,
+            "summary": summary,
+            "full_report": final_text[:4000] if final_text else "",
+            "cypher_queries": json.dumps(queries_executed),
+            "graphs_searched": json.dumps(graphs_searched),
+            "source_node_ids": json.dumps(source_node_ids),
+            "is_empty": is_empty,
+            "time": now.isoformat()
+        }
+
+        if save_to_graph:
+            # MCP-сесія потрібна лише для запису; пошук іде через graph_executor
+            async with get_mcp_pool().session() as session:
+                save_result = await session.call_tool("add_node", arguments={
+                    "node_type": "Research",
+                    "node_data": node_data,
+                    "day_id": day_id,
+                    "time": now.strftime("%H:%M:%S")
                 })
+                print(f"[research_graph] :Research node saved: {research_id}")
+
+                if source_node_ids:
+                    links = [
+                        {"source_id": research_id, "target_id": nid, "type": "SOURCED_FROM"}
+                        for nid in source_node_ids[:20]
+                    ]
+                    await session.call_tool("batch_link_nodes", arguments={"links": links})
+                    print(f"[research_graph] Linked {len(links)} source nodes.")
+        else:
+            print(f"[research_graph] Skipping DB modifications: save_to_graph=False")
+
+        return json.dumps({
+            "status": "success",
+            "research_node_id": research_id,
+            "summary": summary,
+            "graphs_searched": graphs_searched,
+            "queries_executed_count": len(queries_executed),
+            "source_nodes_found": len(source_node_ids),
+            "is_empty": is_empty
+        })
 
     except Exception as e:
         import traceback
@@ -600,104 +649,201 @@ async def research_graph(
         return json.dumps({"status": "error", "message": str(e)})
 
 
-@mcp.tool()
-def check_task_status(task_id: str) -> str:
-    """
-    Перевіряє статус, логи та потенційний результат/помилку асинхронної задачі.
-    """
-    if task_id not in TaskManager:
-        return json.dumps({"status": "error", "message": f"Task {task_id} not found."})
-        
-    state = TaskManager[task_id]
-    
-    with log_lock:
-        logs = "".join(state.logs_buffer)
+def _task_status_response(state, since: int = 0) -> dict:
+    lines, next_offset, truncated = state.read_logs(since)
     
     response = {
         "task_id": state.id,
         "status": state.status,
-        "logs": logs
+        "logs": "".join(lines),
+        "next_offset": next_offset
     }
+    if truncated:
+        # Частина рядків після since вже витіснена з кільцевого буфера
+        response["logs_truncated"] = True
+    if state.dropped_log_bytes:
+        response["dropped_log_bytes"] = state.dropped_log_bytes
     
     if state.result is not None:
         response["result"] = state.result
     if state.error is not None:
         response["error"] = state.error
+    return response
+
+@mcp.tool()
+async def check_task_status(task_id: str, since: int = 0) -> str:
+    """
+    Перевіряє статус, логи та потенційний результат/помилку асинхронної задачі.
+    since — курсор логів: повертаються лише рядки, починаючи з since;
+    next_offset з відповіді передається як since у наступному виклику.
+    """
+    state = await TaskManager.get(task_id)
+    if state is None:
+        return json.dumps({"status": "error", "message": f"Task {task_id} not found."})
+    return json.dumps(_task_status_response(state, since))
+
+# Upper bound for one wait_for_task long-poll (seconds)
+TASK_WAIT_MAX = float(os.getenv("TASK_WAIT_MAX", "60"))
+
+@mcp.tool()
+async def wait_for_task(task_id: str, ctx: Context, timeout: float = 30, since: int = 0) -> str:
+    """
+    Long-poll для асинхронної задачі: чекає її завершення не довше timeout секунд
+    (максимум TASK_WAIT_MAX). Нові рядки логу одразу надсилаються як MCP-сповіщення
+    (log + progress з номером рядка). Повертає те саме, що check_task_status(task_id, since).
+    """
+    state = await TaskManager.get(task_id)
+    if state is None:
+        return json.dumps({"status": "error", "message": f"Task {task_id} not found."})
+    
+    loop = asyncio.get_running_loop()
+    wait_until = loop.time() + max(0.0, min(timeout, TASK_WAIT_MAX))
+    cursor = since
+    while True:
+        version = state.version
+        lines, next_offset, _ = state.read_logs(cursor)
+        if lines:
+            try:
+                await ctx.info("".join(lines).rstrip("\n"))
+                await ctx.report_progress(next_offset, message=state.status)
+            except Exception as e:
+                logger.debug(f"[wait_for_task] Failed to push logs for {task_id}: {e}")
+        cursor = next_offset
+        remaining = wait_until - loop.time()
+        if state.finished or remaining <= 0 or task_id not in TaskManager:
+            # Задачу з persistent-сховища (інша репліка / до рестарту) тут не дочекатися
+            break
+        await state.wait_for_change(version, remaining)
+    
+    return json.dumps(_task_status_response(state, since))
+
+async def handle_research_task(redis_manager, payload: dict):
+    """Обробляє одну задачу research_context з потоку klim:tasks та віддає результат видавцю."""
+    session_id = payload.get("session_id")
+    query = payload.get("query")
+
+    print(f"[background_listener] Processing research task for session: {session_id}")
+    try:
+        result_str = await research_graph(user_query=query, save_to_graph=False)
+        result_data = json.loads(result_str)
         
-    return json.dumps(response)
-
-async def background_listener():
-    import redis.asyncio as aioredis
-    import os
-    import json
-    db_host = os.getenv("FALKORDB_HOST", "falkordb")
-    db_port = int(os.getenv("FALKORDB_PORT", "6379"))
+        if result_data.get("status") == "error":
+            resp_payload = {
+                "session_id": session_id,
+                "status": "error",
+                "error_msg": result_data.get("message")
+            }
+        else:
+            # Ensure we just return context summary. Spec says 'context: Зібраний Markdown текст...'
+            resp_payload = {
+                "session_id": session_id,
+                "status": "success",
+                "context": result_data.get("summary", "Done.")
+            }
+    except Exception as ex:
+        resp_payload = {
+            "session_id": session_id,
+            "status": "error",
+            "error_msg": str(ex)
+        }
+        
+    context_id = payload.get("context_id")
+    if context_id:
+        # Асинхронний режим: видавець не чекає, контекст пишемо одразу у вузол Research_Context
+        result = await get_mcp_pool().call_tool("complete_research_context", {
+            "request_id": payload.get("task_id"),
+            "context_id": context_id,
+            "context": resp_payload.get("context", resp_payload.get("error_msg") or "Empty context"),
+            "status": resp_payload["status"]
+        })
+        print(f"[background_listener] Wrote context {context_id} for {session_id}: "
+              f"{result.content[0].text if result.content else ''}; queue: {task_dispatcher.stats()}")
+        return
+
+    r = await redis_manager.get()
+    await deliver_result(r, payload.get("task_id") or session_id, resp_payload)
+    print(f"[background_listener] Delivered result for {session_id}; queue: {task_dispatcher.stats()}")
+
+
+# klim:tasks workers (created in server_lifespan)
+task_dispatcher: TaskDispatcher = None
+task_consumer: TaskStreamConsumer = None
+
+@mcp.tool()
+def klim_queue_stats() -> str:
+    """
+    Повертає стан черги задач Klim: глибина черги, зайняті воркери, час очікування,
+    кількість оброблених / прострочених / відхилених задач та лічильники потоку.
+    """
+    if task_dispatcher is None:
+        return json.dumps({"status": "error", "message": "Task dispatcher is not running."})
+    return json.dumps({"status": "success", **task_dispatcher.stats(), "stream": task_consumer.stats()})
+
+@mcp.tool()
+def provider_stats() -> str:
+    """
+    Повертає лічильники кешів і пулів llm-provider: виконавець графових запитів (хіти/промахи кешу,
+    маршрутизація читань), HTTP-клієнти LLM, пул MCP-сесій, сховище задач та облікові дані Gemini.
+    """
+    return json.dumps({
+        "status": "success",
+        "falkordb_pool": falkor_manager.stats(),
+        "graph_executor": {"backend": graph_executor.name, **graph_executor.stats()},
+        "llm_http": llm_http.stats(),
+        "mcp_pool": mcp_pool.stats(),
+        "task_store": TaskManager.stats(),
+        "gemini_credentials": gemini_credentials.stats(),
+    })
+
+async def background_listener(redis_manager, consumer: TaskStreamConsumer, dispatcher: TaskDispatcher):
+    """Читає потік klim:tasks і передає задачі диспетчеру; працює задачею в event loop сервера."""
+    async def ack(message_id: str):
+        r = await redis_manager.get()
+        await consumer.ack(r, message_id)
+
+    recover_own = True
     
     while True:
         try:
-            r = aioredis.Redis(host=db_host, port=db_port, decode_responses=False)
-            await r.ping()
-            print("[background_listener] Connected to Redis for klim:tasks")
-            pubsub = r.pubsub()
-            await pubsub.subscribe("klim:tasks")
+            r = await redis_manager.get()
+            await consumer.ensure_group(r)
+            print(f"[background_listener] Reading {consumer.stream} as {consumer.group}/{consumer.consumer}")
             
-            async for message in pubsub.listen():
-                if message["type"] == "message":
-                    try:
-                        data = message["data"]
-                        if isinstance(data, bytes):
-                            data = data.decode('utf-8')
-                        payload = json.loads(data)
-                        
-                        session_id = payload.get("session_id")
-                        task_type = payload.get("task_type")
-                        query = payload.get("query")
-                        
-                        if task_type == "research_context":
-                            print(f"[background_listener] Processing research task for session: {session_id}")
-                            try:
-                                result_str = await research_graph(user_query=query, save_to_graph=False)
-                                result_data = json.loads(result_str)
-                                
-                                if result_data.get("status") == "error":
-                                    resp_payload = {
-                                        "session_id": session_id,
-                                        "status": "error",
-                                        "error_msg": result_data.get("message")
-                                    }
-                                else:
-                                    # Ensure we just return context summary. Spec says 'context: Зібраний Markdown текст...'
-                                    resp_payload = {
-                                        "session_id": session_id,
-                                        "status": "success",
-                                        "context": result_data.get("summary", "Done.")
-                                    }
-                            except Exception as ex:
-                                resp_payload = {
-                                    "session_id": session_id,
-                                    "status": "error",
-                                    "error_msg": str(ex)
-                                }
-                                
-                            await r.publish(f"klim:results:{session_id}", json.dumps(resp_payload))
-                            print(f"[background_listener] Published result for {session_id}")
-                    except Exception as e:
-                        print(f"[background_listener] Error handling message: {e}")
+            while True:
+                # Задачі в роботі не повинні виглядати завислими для XAUTOCLAIM
+                await consumer.keep_alive(r)
+                # Читаємо не більше, ніж вміщує черга диспетчера (backpressure)
+                free = dispatcher.free_slots()
+                if free <= 0:
+                    await asyncio.sleep(0.2)
+                    continue
+                if recover_own:
+                    entries = await consumer.read(r, free, pending=True)
+                    recover_own = False
+                else:
+                    entries = await consumer.claim_stale(r, free)
+                    entries += await consumer.read(r, free - len(entries))
+                
+                for message_id, payload in entries:
+                    if not payload or payload.get("task_type") != "research_context":
+                        print(f"[background_listener] Skipping unsupported stream entry {message_id}")
+                        await consumer.ack(r, message_id)
+                        continue
+                    # Обробка — у воркерах диспетчера; XACK після завершення задачі
+                    deadline = payload.get("deadline")
+                    consumer.track(message_id)
+                    accepted = await dispatcher.submit(
+                        payload, float(deadline) if deadline else None,
+                        done=lambda _payload, message_id=message_id: ack(message_id)
+                    )
+                    if not accepted:
+                        print(f"[background_listener] Task for {payload.get('session_id')} dropped (expired or queue full)")
+                        await consumer.ack(r, message_id)
         except Exception as e:
             print(f"[background_listener] Redis connection error, retrying in 5s: {e}")
+            await redis_manager.reset()
             await asyncio.sleep(5)
 
-def start_redis_listener_thread():
-    def run_loop():
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(background_listener())
-    
-    t = threading.Thread(target=run_loop, daemon=True)
-    t.start()
-
-start_redis_listener_thread()
-
 if __name__ == "__main__":
     import sys
     if "--sse" in sys.argv:
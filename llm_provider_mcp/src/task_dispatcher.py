@@ -0,0 +1,142 @@
+"""
+Диспетчер задач klim:tasks: обмежена черга та N паралельних воркерів.
+
+Слухач лише кладе задачу в чергу, тож повільний виклик Gemini для однієї
+сесії не блокує задачі інших. Черга обмежена: коли вона повна, submit()
+чекає (backpressure на читання з каналу) не довше submit_timeout.
+Кожна задача має дедлайн від видавця (поле "deadline", unix time): прострочені
+задачі відкидаються без обробки, а обробка обривається на дедлайні — після
+нього видавець уже не чекає на результат.
+Необов'язковий колбек done(payload) викликається, коли задача покинула
+чергу з будь-яким результатом (оброблена, впала чи прострочена) — через
+нього слухач підтверджує запис потоку (XACK).
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger("llm-provider-mcp")
+
+
+class _QueuedTask:
+    __slots__ = ("payload", "deadline", "done", "enqueued_at")
+
+    def __init__(self, payload: dict, deadline: float = None, done=None):
+        self.payload = payload
+        self.deadline = deadline
+        self.done = done
+        self.enqueued_at = time.monotonic()
+
+
+class TaskDispatcher:
+    def __init__(self, handler, workers: int = 4, max_queue: int = 100, submit_timeout: float = 5.0,
+                 default_ttl: float = None):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.submit_timeout = submit_timeout
+        self.default_ttl = default_ttl
+        self._queue = None
+        self._tasks = []
+        self.busy = 0
+        self.processed = 0
+        self.failed = 0
+        self.expired = 0
+        self.rejected = 0
+        self._waits_ms = deque(maxlen=200)
+
+    def start(self):
+        """Запускає воркерів у поточному event loop."""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    def free_slots(self) -> int:
+        """Скільки задач ще вміщує черга (для читання з потоку порціями без переповнення)."""
+        if self._queue is None:
+            return 0
+        return max(0, self.max_queue - self._queue.qsize())
+
+    async def submit(self, payload: dict, deadline: float = None, done=None) -> bool:
+        """Ставить задачу в чергу. False — черга переповнена довше submit_timeout або задача вже прострочена."""
+        if deadline is None and self.default_ttl:
+            deadline = time.time() + self.default_ttl
+        if deadline is not None and deadline <= time.time():
+            self.expired += 1
+            return False
+        try:
+            await asyncio.wait_for(self._queue.put(_QueuedTask(payload, deadline, done)), timeout=self.submit_timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            logger.warning(f"[dispatcher] Queue full ({self.max_queue}), task rejected")
+            return False
+
+    async def _worker(self, index: int):
+        while True:
+            item = await self._queue.get()
+            try:
+                self._waits_ms.append((time.monotonic() - item.enqueued_at) * 1000)
+                remaining = item.deadline - time.time() if item.deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    self.expired += 1
+                    logger.warning(f"[dispatcher] Dropping expired task {item.payload.get('session_id')}")
+                    continue
+                self.busy += 1
+                try:
+                    await asyncio.wait_for(self.handler(item.payload), timeout=remaining)
+                    self.processed += 1
+                except asyncio.CancelledError:
+                    # Зупинка сервера: задачу не підтверджуємо, її дообробить інший воркер
+                    item.done = None
+                    raise
+                except asyncio.TimeoutError:
+                    self.expired += 1
+                    logger.warning(f"[dispatcher] Task {item.payload.get('session_id')} passed its deadline")
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"[dispatcher] Worker {index} task failed: {e}")
+                finally:
+                    self.busy -= 1
+            finally:
+                self._queue.task_done()
+                if item.done is not None:
+                    try:
+                        await item.done(item.payload)
+                    except Exception as e:
+                        logger.error(f"[dispatcher] Completion callback failed: {e}")
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits_ms)
+        return {
+            "workers": self.workers,
+            "busy": self.busy,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "processed": self.processed,
+            "failed": self.failed,
+            "expired": self.expired,
+            "rejected": self.rejected,
+            "wait_ms_avg": round(sum(waits) / len(waits), 1) if waits else 0.0,
+            "wait_ms_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 1) if waits else 0.0,
+            "wait_ms_max": round(waits[-1], 1) if waits else 0.0,
+        }
+
+    async def drain(self, timeout: float) -> bool:
+        """Чекає, поки воркери доопрацюють чергу (не довше timeout), потім зупиняє їх. False — не встигли."""
+        drained = True
+        if self._queue is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=timeout)
+            except asyncio.TimeoutError:
+                drained = False
+        await self.stop()
+        return drained
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
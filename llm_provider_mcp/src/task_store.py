@@ -0,0 +1,389 @@
+"""
+Сховище стану асинхронних задач агента (start_async_agent_task / check_task_status).
+
+Задачі живуть у пам'яті з обмеженнями:
+  * завершені задачі витісняються за TTL (TASK_STORE_TTL) та LRU, коли
+    задач більше за TASK_STORE_MAX_TASKS (задачі, що виконуються, не витісняються);
+  * логи кожної задачі — кільцевий буфер до TASK_LOG_MAX_BYTES: найстаріші рядки
+    відкидаються, а номери рядків абсолютні, тож читач продовжує з курсора since.
+
+Буфер логів — власний deque кожної задачі без спільного lock: append/popleft
+у deque атомарні, а пише в нього лише код самої задачі. Зберігаються сирі
+LogRecord: підстановка args та форматування рядка ("час - рівень - повідомлення")
+відкладені до читання логів. Ліміт байтів рахує і шаблон, і args запису (великий
+аргумент на кшталт повної JSON-відповіді під "%.300s" займає пам'ять повністю).
+Traceback одразу перетворюється на текст, щоб запис не тримав кадри стека.
+
+Необов'язкова персистентність (TASK_STORE_BACKEND=file|redis) зберігає знімок
+задачі на старті та по завершенню, тож check_task_status знаходить задачу після
+перезапуску або на іншій репліці. Задача зі статусом "running", яку цей процес
+записав, але вже не виконує, повертається як "interrupted".
+"""
+import asyncio
+import copy
+import json
+import logging
+import os
+import socket
+import sys
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+
+logger = logging.getLogger("llm-provider-mcp")
+
+FINISHED_STATUSES = ("completed", "failed", "cancelled", "interrupted")
+
+_formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+
+
+def _format_line(entry) -> str:
+    """Рядок логу: LogRecord форматується тут, знімки з persistent-сховища вже є рядками."""
+    if isinstance(entry, str):
+        return entry
+    return _formatter.format(entry) + "\n"
+
+
+def _arg_size(arg) -> int:
+    if isinstance(arg, (str, bytes)):
+        return len(arg)
+    return sys.getsizeof(arg)
+
+
+def _entry_size(entry) -> int:
+    # Оцінка без форматування: для LogRecord — шаблон повідомлення плюс розмір його args
+    if isinstance(entry, str):
+        return len(entry.encode("utf-8"))
+    args = entry.args
+    if isinstance(args, dict):
+        args = args.values()
+    elif not isinstance(args, tuple):
+        args = () if args is None else (args,)
+    return len(str(entry.msg)) + sum(_arg_size(arg) for arg in args) + len(entry.exc_text or "") + 1
+
+
+def _compact_record(record: logging.LogRecord) -> logging.LogRecord:
+    """Копія запису з traceback у вигляді тексту (кадри стека не тримаються в буфері)."""
+    if not record.exc_info:
+        return record
+    record = copy.copy(record)
+    record.exc_text = record.exc_text or _formatter.formatException(record.exc_info)
+    record.exc_info = None
+    return record
+
+
+@dataclass
+class TaskState:
+    id: str
+    status: str  # "running", "completed", "failed", "cancelled", "interrupted"
+    logs_buffer: deque = field(default_factory=deque)
+    result: str = None
+    error: str = None
+    task_obj: asyncio.Task = None
+    owner: str = field(default_factory=socket.gethostname)
+    created_at: float = field(default_factory=time.time)
+    finished_at: float = None
+    log_bytes: int = 0
+    log_offset: int = 0  # абсолютний номер першого збереженого рядка
+    dropped_log_bytes: int = 0
+    max_log_bytes: int = 256 * 1024
+    version: int = 0  # зростає з кожним новим рядком логу та зміною статусу
+    _changed: asyncio.Event = field(default=None, repr=False)
+    _loop: asyncio.AbstractEventLoop = field(default=None, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def append_log(self, entry):
+        """Додає рядок або LogRecord, відкидаючи найстаріші записи понад max_log_bytes."""
+        if isinstance(entry, logging.LogRecord):
+            entry = _compact_record(entry)
+        self.logs_buffer.append(entry)
+        self.log_bytes += _entry_size(entry)
+        while self.log_bytes > self.max_log_bytes and len(self.logs_buffer) > 1:
+            try:
+                dropped = _entry_size(self.logs_buffer.popleft())
+            except IndexError:
+                break
+            self.log_bytes -= dropped
+            self.dropped_log_bytes += dropped
+            self.log_offset += 1
+        self.notify()
+
+    @property
+    def next_offset(self) -> int:
+        return self.log_offset + len(self.logs_buffer)
+
+    def _snapshot(self) -> tuple:
+        # Запис із потоку (to_thread) може змінити deque під час копіювання — тоді повтор
+        while True:
+            offset = self.log_offset
+            try:
+                entries = list(self.logs_buffer)
+            except RuntimeError:
+                continue
+            if offset == self.log_offset:
+                return offset, entries
+
+    def read_logs(self, since: int = 0) -> tuple:
+        """Рядки, починаючи з абсолютного номера since: (рядки, наступний курсор, чи були рядки втрачені)."""
+        offset, entries = self._snapshot()
+        start = max(0, since - offset)
+        lines = [_format_line(entry) for entry in entries[start:]]
+        return lines, offset + len(entries), since < offset
+
+    def notify(self):
+        """Будить тих, хто чекає в wait_for_change (лог може писатися і з потоку to_thread)."""
+        self.version += 1
+        if self._changed is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._changed.set()
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._changed.set)
+
+    async def wait_for_change(self, version: int, timeout: float) -> bool:
+        """Чекає, поки version зміниться, не довше timeout. False — тайм-аут."""
+        if self.version != version:
+            return True
+        if self._changed is None:
+            self._loop = asyncio.get_running_loop()
+            self._changed = asyncio.Event()
+        self._changed.clear()
+        if self.version != version:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def to_dict(self) -> dict:
+        offset, entries = self._snapshot()
+        return {
+            "id": self.id,
+            "status": self.status,
+            "logs": [_format_line(entry) for entry in entries],
+            "result": self.result,
+            "error": self.error,
+            "owner": self.owner,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "log_offset": offset,
+            "dropped_log_bytes": self.dropped_log_bytes,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, max_log_bytes: int = 256 * 1024) -> "TaskState":
+        state = cls(
+            id=data["id"],
+            status=data.get("status", "failed"),
+            result=data.get("result"),
+            error=data.get("error"),
+            owner=data.get("owner", ""),
+            created_at=data.get("created_at", time.time()),
+            finished_at=data.get("finished_at"),
+            max_log_bytes=max_log_bytes,
+        )
+        state.log_offset = data.get("log_offset", 0)
+        for line in data.get("logs", []):
+            state.append_log(line)
+        state.dropped_log_bytes += data.get("dropped_log_bytes", 0)
+        return state
+
+
+class FileTaskBackend:
+    """Знімок задачі — JSON-файл у каталозі; запис атомарний (тимчасовий файл + os.replace)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, task_id: str) -> str:
+        return os.path.join(self.path, f"{os.path.basename(task_id)}.json")
+
+    def _save(self, data: dict):
+        target = self._file(data["id"])
+        tmp = f"{target}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, target)
+
+    def _load(self, task_id: str):
+        try:
+            with open(self._file(task_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _delete(self, task_id: str):
+        try:
+            os.remove(self._file(task_id))
+        except FileNotFoundError:
+            pass
+
+    async def save(self, data: dict):
+        await asyncio.to_thread(self._save, data)
+
+    async def load(self, task_id: str):
+        return await asyncio.to_thread(self._load, task_id)
+
+    async def delete(self, task_id: str):
+        await asyncio.to_thread(self._delete, task_id)
+
+
+class RedisTaskBackend:
+    """Знімок задачі — ключ <prefix>:<task_id> у Redis з TTL."""
+
+    def __init__(self, get_client, prefix: str = "klim:task", ttl: int = 86400):
+        self._get_client = get_client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _key(self, task_id: str) -> str:
+        return f"{self.prefix}:{task_id}"
+
+    async def save(self, data: dict):
+        r = await self._get_client()
+        await r.set(self._key(data["id"]), json.dumps(data), ex=self.ttl)
+
+    async def load(self, task_id: str):
+        r = await self._get_client()
+        raw = await r.get(self._key(task_id))
+        return json.loads(raw) if raw is not None else None
+
+    async def delete(self, task_id: str):
+        r = await self._get_client()
+        await r.delete(self._key(task_id))
+
+
+class TaskStore:
+    def __init__(self, max_tasks: int = 1000, ttl: float = 3600.0, max_log_bytes: int = 256 * 1024, backend=None):
+        self.max_tasks = max_tasks
+        self.ttl = ttl
+        self.max_log_bytes = max_log_bytes
+        self.backend = backend
+        self._tasks = OrderedDict()  # task_id -> TaskState, від найдавніше використаної
+        self.evicted = 0
+        self.loaded = 0
+        self.persist_errors = 0
+
+    @classmethod
+    def from_env(cls, get_redis=None):
+        """TASK_STORE_BACKEND=memory (за замовчуванням), file (TASK_STORE_PATH) або redis."""
+        kind = os.getenv("TASK_STORE_BACKEND", "memory").lower()
+        ttl = float(os.getenv("TASK_STORE_TTL", "3600"))
+        backend = None
+        if kind == "file":
+            backend = FileTaskBackend(os.getenv("TASK_STORE_PATH", "data/tasks"))
+        elif kind == "redis" and get_redis is not None:
+            backend = RedisTaskBackend(
+                get_redis,
+                prefix=os.getenv("TASK_STORE_PREFIX", "klim:task"),
+                ttl=int(os.getenv("TASK_STORE_PERSIST_TTL", "86400")),
+            )
+        elif kind != "memory":
+            logger.warning(f"[task_store] Unknown TASK_STORE_BACKEND={kind!r}, keeping tasks in memory only")
+        return cls(
+            max_tasks=int(os.getenv("TASK_STORE_MAX_TASKS", "1000")),
+            ttl=ttl,
+            max_log_bytes=int(os.getenv("TASK_LOG_MAX_BYTES", str(256 * 1024))),
+            backend=backend,
+        )
+
+    def __contains__(self, task_id: str) -> bool:
+        return task_id in self._tasks
+
+    def __getitem__(self, task_id: str) -> TaskState:
+        return self._tasks[task_id]
+
+    def peek(self, task_id: str):
+        """Задача з пам'яті без оновлення LRU (для обробника логів)."""
+        return self._tasks.get(task_id)
+
+    def running(self) -> list:
+        return [state for state in self._tasks.values() if not state.finished]
+
+    def create(self, task_id: str) -> TaskState:
+        state = TaskState(id=task_id, status="running", max_log_bytes=self.max_log_bytes)
+        self._tasks[task_id] = state
+        self.prune()
+        return state
+
+    def prune(self):
+        """Витісняє завершені задачі: прострочені за TTL, потім найдавніше використані понад max_tasks."""
+        now = time.time()
+        for task_id in [tid for tid, st in self._tasks.items()
+                        if st.finished and st.finished_at is not None and now - st.finished_at > self.ttl]:
+            del self._tasks[task_id]
+            self.evicted += 1
+        excess = len(self._tasks) - self.max_tasks
+        if excess <= 0:
+            return
+        for task_id in [tid for tid, st in self._tasks.items() if st.finished][:excess]:
+            del self._tasks[task_id]
+            self.evicted += 1
+
+    async def get(self, task_id: str):
+        """Задача з пам'яті (оновлює LRU) або з персистентного сховища."""
+        state = self._tasks.get(task_id)
+        if state is not None:
+            self._tasks.move_to_end(task_id)
+            return state
+        if self.backend is None:
+            return None
+        try:
+            data = await self.backend.load(task_id)
+        except Exception as e:
+            logger.warning(f"[task_store] Failed to load task {task_id}: {e}")
+            return None
+        if data is None:
+            return None
+        state = TaskState.from_dict(data, self.max_log_bytes)
+        if state.status == "running" and state.owner == socket.gethostname():
+            # Наш процес запускав задачу, але в пам'яті її вже немає — процес перезапускався
+            state.status = "interrupted"
+            state.error = "Task was interrupted by a restart of the provider."
+        self.loaded += 1
+        return state
+
+    async def persist(self, state: TaskState):
+        if self.backend is None:
+            return
+        try:
+            await self.backend.save(state.to_dict())
+        except Exception as e:
+            self.persist_errors += 1
+            logger.warning(f"[task_store] Failed to persist task {state.id}: {e}")
+
+    async def finish(self, state: TaskState, status: str, result: str = None, error: str = None):
+        """Фіксує завершення задачі та зберігає її знімок."""
+        state.status = status
+        if result is not None:
+            state.result = result
+        if error is not None:
+            state.error = error
+        state.finished_at = time.time()
+        state.task_obj = None
+        state.notify()
+        await self.persist(state)
+        self.prune()
+
+    def stats(self) -> dict:
+        running = sum(1 for st in self._tasks.values() if not st.finished)
+        return {
+            "tasks": len(self._tasks),
+            "running": running,
+            "max_tasks": self.max_tasks,
+            "ttl": self.ttl,
+            "log_bytes": sum(st.log_bytes for st in self._tasks.values()),
+            "evicted": self.evicted,
+            "loaded": self.loaded,
+            "persist_errors": self.persist_errors,
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+        }
@@ -31,23 +31,25 @@ async def main():
                 print("Failed to get task_id")
                 return
                 
-            # Poll status
+            # Long-poll status; the cursor keeps each response to new log lines only
+            since = 0
             while True:
-                status_res = await session.call_tool("check_task_status", {
-                    "task_id": task_id
+                status_res = await session.call_tool("wait_for_task", {
+                    "task_id": task_id,
+                    "timeout": 30,
+                    "since": since
                 })
                 
                 status_info = json.loads(status_res.content[0].text)
                 state = status_info.get("status")
+                since = status_info.get("next_offset", since)
                 
-                print(f"Status: {state} | Logs length: {len(status_info.get('logs', ''))}")
+                print(f"Status: {state} | New logs: {len(status_info.get('logs', ''))} chars")
                 
-                if state in ["completed", "failed", "cancelled"]:
+                if state in ["completed", "failed", "cancelled", "interrupted"]:
                     print("\nFinal State Data:")
                     print(json.dumps(status_info, indent=2, ensure_ascii=False))
                     break
-                    
-                await asyncio.sleep(2)
 
 if __name__ == "__main__":
     asyncio.run(main())